@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# Assign zoning to parcels, using processed Zoning.Space output
+
+# Copyright 2018 Zoning.Space contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os.path
+from argparse import ArgumentParser
+
+parser = ArgumentParser(description='Assign each parcel the zone that covers most of its area')
+parser.add_argument('parcels', help='Parcels, in any format OGR can read, or a zipped shapefile')
+parser.add_argument('zoning', help='Processed zoning, as written by loadZoning.py')
+parser.add_argument('outfile', help='CSV file to write with the zone attributes of each parcel')
+parser.add_argument('--id', required=True, metavar='COLUMN', help='Column of the parcels containing a unique parcel ID')
+parser.add_argument('--columns', nargs='+', metavar='COLUMN', help='Zoning attributes to include, default all')
+parser.add_argument('--splits', metavar='CSV', help='Also write each zone of parcels that are split between zones, with the share of the parcel in it')
+parser.add_argument('--workers', type=int, help='Number of worker processes, default the number of CPUs')
+parser.add_argument('--chunk-size', type=int, default=10000, metavar='N', help='Number of parcels sent to a worker at once')
+args = parser.parse_args()
+
+for infile in (args.parcels, args.zoning):
+    if not os.path.exists(infile):
+        parser.error(f'{infile} does not exist')
+
+# the GIS stack is slow to import, so wait until the arguments have been checked
+import geopandas as gp
+from src.ingest.shputils import readZippedShapefile
+from src.zoning.parcels import assignParcels
+
+print(f'Reading parcels from {args.parcels}...')
+parcels = readZippedShapefile(args.parcels) if args.parcels.endswith('.zip') else gp.read_file(args.parcels)
+if args.id not in parcels.columns:
+    parser.error(f'Parcels have no column {args.id}')
+
+print(f'Reading zoning from {args.zoning}...')
+zoning = gp.read_file(args.zoning)
+columns = args.columns if args.columns else [col for col in zoning.columns if col != zoning.geometry.name]
+missing = [col for col in columns if col not in zoning.columns]
+if len(missing) > 0:
+    parser.error(f'Zoning has no column(s) {", ".join(missing)}')
+
+print('Assigning zones to parcels...')
+assignments, splits = assignParcels(parcels, zoning, args.id, columns, workers=args.workers, chunkSize=args.chunk_size)
+
+print(f'Writing {args.outfile}...')
+assignments.to_csv(args.outfile, index=False)
+if args.splits:
+    print(f'Writing {args.splits}...')
+    splits.to_csv(args.splits, index=False)
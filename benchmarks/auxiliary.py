@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# Benchmark loading a hook's auxiliary layers one after another against loading them concurrently, on synthetic zipped
+# shapefiles
+#
+# Usage (from the repository root): python -m benchmarks.auxiliary
+
+# Copyright 2018 Zoning.Space contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+from os.path import join, basename
+from glob import glob
+from zipfile import ZipFile, ZIP_DEFLATED
+from time import perf_counter
+from tempfile import mkdtemp
+from shutil import rmtree
+from argparse import ArgumentParser
+import numpy as np
+import geopandas as gp
+from shapely.geometry import Polygon
+
+from src.ingest.auxiliary import shapefile, loadLayers
+
+def syntheticLayer (directory, name, n, rng):
+    "Write a zipped shapefile of n random octagons in California state plane zone 3, returning the zip file name"
+    x = rng.uniform(1.8e6, 1.85e6, n)
+    y = rng.uniform(6.4e5, 6.5e5, n)
+    angles = np.linspace(0, 2 * np.pi, 9)[:-1]
+    geoms = [Polygon(list(zip(x0 + 30 * np.cos(angles), y0 + 30 * np.sin(angles)))) for x0, y0 in zip(x, y)]
+    data = gp.GeoDataFrame({'code': rng.choice(['A', 'B', 'C'], n), 'geometry': geoms}, geometry='geometry', crs={'init': 'epsg:26943'})
+    data.to_file(join(directory, name + '.shp'))
+    with ZipFile(join(directory, name + '.zip'), 'w', ZIP_DEFLATED) as zf:
+        for member in glob(join(directory, name + '.*')):
+            if not member.endswith('.zip'):
+                zf.write(member, basename(member))
+    return name + '.zip'
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Benchmark auxiliary layer loading')
+    parser.add_argument('--layers', type=int, default=3, help='Number of auxiliary layers')
+    parser.add_argument('--features', type=int, default=50000, help='Features per layer')
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(42)
+    tmp = mkdtemp()
+    try:
+        declarations = {f'layer{i}': shapefile(syntheticLayer(tmp, f'layer{i}', args.features, rng), epsg=26942) for i in range(args.layers)}
+
+        start = perf_counter()
+        for name, loader in declarations.items():
+            loader(tmp, None)
+        print(f'sequential: {perf_counter() - start:.2f}s')
+
+        start = perf_counter()
+        layers = loadLayers(declarations, tmp)
+        for name in layers.keys():
+            layers[name]
+        print(f'concurrent: {perf_counter() - start:.2f}s')
+    finally:
+        rmtree(tmp)
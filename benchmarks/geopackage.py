@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# Benchmark writing GeoPackages with fiona against GeoPackageCollater, on synthetic data with the Zoning.Space schema
+#
+# Usage (from the repository root): python -m benchmarks.geopackage
+
+# Copyright 2018 Zoning.Space contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from time import perf_counter
+from tempfile import mkdtemp
+from shutil import rmtree
+from os.path import join
+from argparse import ArgumentParser
+import numpy as np
+import geopandas as gp
+from shapely.geometry import Polygon
+
+from src.ingest import Collater
+from src.ingest.geopackage import GeoPackageCollater
+from src.zoning.zoneingest import schema
+
+def syntheticCity (name, n, rng):
+    "A city of n random quadrilaterals with random attributes, in California state plane zone 3"
+    x = rng.uniform(1.8e6, 1.85e6, n)
+    y = rng.uniform(6.4e5, 6.5e5, n)
+    geoms = [Polygon([(x0, y0), (x0 + 50, y0), (x0 + 50, y0 + 80), (x0, y0 + 80)]) for x0, y0 in zip(x, y)]
+    data = gp.GeoDataFrame({'geometry': geoms}, geometry='geometry', crs={'init': 'epsg:26943'})
+    for col, typ in schema['properties'].items():
+        if typ == 'float':
+            data[col] = np.where(rng.uniform(size=n) < 0.2, np.nan, rng.uniform(0, 100, n))
+        elif typ == 'int':
+            data[col] = rng.randint(0, 2, n)
+        else:
+            data[col] = rng.choice(['yes', 'no', 'conditional'], n)
+    data['jurisdiction'] = name
+    return data
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Benchmark GeoPackage output')
+    parser.add_argument('--cities', type=int, default=6, help='Number of cities')
+    parser.add_argument('--features', type=int, default=20000, help='Features per city')
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(42)
+    cities = [syntheticCity(f'City {i}', args.features, rng) for i in range(args.cities)]
+
+    tmp = mkdtemp()
+    try:
+        for label, collater in [
+            ('fiona', Collater(schema, join(tmp, 'fiona.gpkg'), driver='GPKG')),
+            ('GeoPackageCollater', GeoPackageCollater(schema, join(tmp, 'bulk.gpkg')))
+        ]:
+            start = perf_counter()
+            with collater:
+                for city in cities:
+                    collater.collate(city)
+            print(f'{label}: {perf_counter() - start:.1f}s for {args.cities * args.features} features')
+    finally:
+        rmtree(tmp)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# Benchmark fastOverlay on San Francisco height districts over zoning
+#
+# Usage (from the repository root, with the San Francisco data in data/zoning): python -m benchmarks.overlay
+
+# Copyright 2018 Zoning.Space contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from os.path import join, dirname
+from time import perf_counter
+from argparse import ArgumentParser
+import geopandas as gp
+import numpy as np
+import shapely.ops
+
+from src.ingest.shputils import readZippedShapefile, fastOverlay
+
+datadir = join(dirname(__file__), '..', 'data', 'zoning')
+
+def referenceOverlay (df1, df2, minArea=100):
+    "The original fastOverlay, which computes a buffered difference for every polygon, for comparison"
+    outrows = []
+    for i in range(len(df1)):
+        geom = df1.iloc[i].geometry
+        intersectingGeoms = df2.intersects(geom)
+        intersections = df2[intersectingGeoms].intersection(geom)
+        remainingGeom = geom.difference(shapely.ops.unary_union(intersections.values).buffer(1e-2))
+
+        for index, intersection in intersections[intersections.area > minArea].iteritems():
+            if intersection.type == 'Polygon':
+                parts = [intersection]
+            elif intersection.type == 'MultiPolygon':
+                parts = intersection.geoms
+            elif intersection.type == 'GeometryCollection':
+                parts = [part for part in intersection.geoms if part.type == 'Polygon']
+
+            for part in parts:
+                row = df1.iloc[i].copy()
+                row = row.combine_first(df2.loc[index])
+                row['geometry'] = part
+                outrows.append(row)
+
+        if remainingGeom.type == 'Polygon':
+            remainingGeoms = [remainingGeom]
+        elif remainingGeom.type == 'MultiPolygon':
+            remainingGeoms = remainingGeom.geoms
+        elif remainingGeom.type == 'GeometryCollection':
+            remainingGeoms = [part for part in remainingGeom.geoms if part.type == 'Polygon']
+
+        for part in remainingGeoms:
+            if part.area > minArea:
+                row = df1.iloc[i].copy()
+                row['geometry'] = part
+                outrows.append(row)
+
+    return gp.GeoDataFrame(outrows, geometry='geometry').reset_index(drop=True)
+
+def timed (label, fn):
+    start = perf_counter()
+    result = fn()
+    elapsed = perf_counter() - start
+    print(f'{label}: {elapsed:.1f}s, {len(result)} features, total area {np.sum(result.area) / 1e6:.3f} sq km')
+    return result
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Benchmark fastOverlay on San Francisco height districts over zoning')
+    parser.add_argument('--limit', type=int, help='Only overlay the first LIMIT zoning polygons')
+    parser.add_argument('--skip-reference', action='store_true', help='Do not time the original implementation')
+    args = parser.parse_args()
+
+    zoning = readZippedShapefile(join(datadir, 'sanfrancisco.zip')).to_crs(epsg=26943)
+    zoning = zoning[~zoning.geometry.isnull()]
+    if args.limit:
+        zoning = zoning.iloc[:args.limit]
+    heightDistricts = readZippedShapefile(join(datadir, 'sanfrancisco-heightbulk.zip')).to_crs(epsg=26943)
+    print(f'{len(zoning)} zoning polygons, {len(heightDistricts)} height districts')
+
+    result = timed('fastOverlay', lambda: fastOverlay(zoning, heightDistricts))
+    if not args.skip_reference:
+        reference = timed('reference', lambda: referenceOverlay(zoning, heightDistricts))
+        print(f'area difference: {abs(np.sum(result.area) - np.sum(reference.area)):.1f} sq m')
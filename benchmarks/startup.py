@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# Benchmark how long the command line tools take to print help, reject bad arguments and report missing input files,
+# none of which should need the GIS stack to be imported
+#
+# Usage (from the repository root): python -m benchmarks.startup
+
+# Copyright 2018 Zoning.Space contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+import subprocess
+from time import perf_counter
+from argparse import ArgumentParser
+
+COMMANDS = [
+    ('loadZoning.py --help', ['loadZoning.py', '--help']),
+    ('loadZoning.py (missing outfile)', ['loadZoning.py']),
+    ('loadZoning.py --check (missing shapefile)', ['loadZoning.py', '--check', '--include', 'no-such-city', 'sanfrancisco']),
+    ('prepopulateSpecfile.py --help', ['prepopulateSpecfile.py', '--help']),
+    ('prepopulateSpecfile.py (missing shapefile)', ['prepopulateSpecfile.py', 'no-such-city']),
+    ('diffZoning.py --help', ['diffZoning.py', '--help']),
+    # for comparison, the cost of importing the GIS stack
+    ('import geopandas, fiona', ['-c', 'import geopandas, fiona'])
+]
+
+def timeCommand (command, repeats):
+    "Best wall clock time of running command in a fresh interpreter"
+    times = []
+    for i in range(repeats):
+        start = perf_counter()
+        subprocess.run([sys.executable] + command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, stdin=subprocess.DEVNULL)
+        times.append(perf_counter() - start)
+    return min(times)
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Benchmark command line startup time')
+    parser.add_argument('--repeats', type=int, default=5, help='Number of times to run each command')
+    args = parser.parse_args()
+
+    for label, command in COMMANDS:
+        print(f'{label}: {timeCommand(command, args.repeats):.2f}s')
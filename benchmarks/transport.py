@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# Benchmark handing a large polygon layer to worker processes with pickle against the shared-memory transport
+#
+# Usage (from the repository root): python -m benchmarks.transport
+
+# Copyright 2018 Zoning.Space contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from time import perf_counter
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import geopandas as gp
+from shapely.geometry import Polygon
+
+from src.ingest.transport import packFrame
+
+def syntheticLayer (n, rng):
+    "n random hexagons with a few attribute columns"
+    x = rng.uniform(0, 1e5, n)
+    y = rng.uniform(0, 1e5, n)
+    angles = np.linspace(0, 2 * np.pi, 7)[:-1]
+    geoms = [Polygon(list(zip(x0 + 20 * np.cos(angles), y0 + 20 * np.sin(angles)))) for x0, y0 in zip(x, y)]
+    return gp.GeoDataFrame({
+        'zone': rng.choice(['R-1', 'R-2', 'C-1', 'M-1'], n),
+        'height': rng.uniform(0, 100, n),
+        'geometry': geoms
+    }, geometry='geometry', crs={'init': 'epsg:26943'})
+
+# Worker tasks: summarize the frame received, so the cost of receiving it is included
+def totalAreaPickled (data):
+    return np.sum(data.area)
+
+def totalAreaShared (handle):
+    return np.sum(handle.geometry().area)
+
+def heightShared (handle):
+    # only touches a numeric column, so geometries are never decoded
+    return np.sum(handle.column('height'))
+
+def timed (label, fn):
+    start = perf_counter()
+    result = fn()
+    print(f'{label}: {perf_counter() - start:.2f}s')
+    return result
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Benchmark transferring frames between processes')
+    parser.add_argument('--features', type=int, default=500000, help='Number of polygons')
+    args = parser.parse_args()
+
+    data = syntheticLayer(args.features, np.random.RandomState(42))
+
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        pool.submit(np.sum, [0]).result() # start the worker before timing
+
+        timed('pickle, total area', lambda: pool.submit(totalAreaPickled, data).result())
+
+        handle = timed('pack', lambda: packFrame(data))
+        try:
+            timed('shared, total area', lambda: pool.submit(totalAreaShared, handle).result())
+            timed('shared, numeric column only', lambda: pool.submit(heightShared, handle).result())
+        finally:
+            handle.release()
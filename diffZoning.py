@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# Compare two builds of the zoning output and report what changed in each jurisdiction
+
+# Copyright 2018 Zoning.Space contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os.path
+from argparse import ArgumentParser
+
+parser = ArgumentParser(description='Compare two builds of Zoning.Space output')
+parser.add_argument('old', help='Previous build')
+parser.add_argument('new', help='New build')
+parser.add_argument('--changes', metavar='CSV', help='Write a row for each changed feature to CSV')
+args = parser.parse_args()
+
+for build in (args.old, args.new):
+    if not os.path.exists(build):
+        parser.error(f'{build} does not exist')
+
+# imported after parsing arguments, so that --help and argument errors do not wait for the GIS stack to load
+import pandas as pd
+from src.ingest.diff import readBuild, diffBuilds, summarizeChanges
+from src.zoning.zoneingest import KEY_COLUMNS
+
+print(f'Reading {args.old}...')
+old = readBuild(args.old, KEY_COLUMNS)
+print(f'Reading {args.new}...')
+new = readBuild(args.new, KEY_COLUMNS)
+
+print('Comparing builds...')
+changes = diffBuilds(old, new, KEY_COLUMNS)
+
+with pd.option_context('display.max_rows', None, 'display.width', 200):
+    print(summarizeChanges(changes))
+
+if args.changes:
+    changes[changes.change != 'unchanged'].to_csv(args.changes, index=False)
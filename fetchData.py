@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# Download the source data needed to process the selected cities, verifying it against the source's checksum manifest
+
+# Copyright 2018 Zoning.Space contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os.path
+from sys import argv, exit
+from pathlib import Path
+from argparse import ArgumentParser
+
+parser = ArgumentParser(description='Download zoning source data, verifying it against a SHA256SUMS manifest')
+parser.add_argument('source', help='Directory, file://, http(s):// or s3:// URL containing the data files and a SHA256SUMS manifest (e.g. s3://zoning-data/zoning)')
+parser.add_argument('--include', nargs='+', help='Cit(ies) to download data for, default all')
+parser.add_argument('--exclude', nargs='+', help='Cit(ies) to omit')
+parser.add_argument('--all', action='store_true', help='Download every file in the manifest, not just those used by the selected cities')
+parser.add_argument('--dest', default=os.path.join(os.path.dirname(argv[0]), 'data', 'zoning'), help='Directory to download to, default data/zoning')
+parser.add_argument('--workers', type=int, default=4, help='Number of files to download at once')
+parser.add_argument('--endpoint-url', help='For s3:// sources, the URL of an S3-compatible server to use instead of AWS')
+parser.add_argument('--requester-pays', action='store_true', help='For s3:// sources, agree to pay for requests to a requester pays bucket (such as zoning-data)')
+parser.add_argument('--write-manifest', action='store_true', help='Instead of downloading, write a SHA256SUMS manifest for the files in source, a local directory')
+args = parser.parse_args()
+
+from src.ingest.fetch import fetch, openSource, writeManifest, parseManifest, MANIFEST
+
+if args.write_manifest:
+    if not os.path.isdir(args.source):
+        parser.error(f'{args.source} is not a directory')
+    names = writeManifest(args.source)
+    print(f'Wrote checksums of {len(names)} files to {os.path.join(args.source, MANIFEST)}')
+    exit(0)
+
+source = openSource(args.source, endpointUrl=args.endpoint_url, requesterPays=args.requester_pays)
+try:
+    manifest = parseManifest(source.read(MANIFEST).decode('utf-8'))
+except OSError as e:
+    print(f'Could not read {MANIFEST} from {args.source}: {e}')
+    exit(1)
+
+if args.all:
+    names = sorted(manifest.keys())
+else:
+    specpath = Path(os.path.join(os.path.dirname(argv[0]), 'src', 'zoning', 'specs'))
+    slugs = sorted(os.path.basename(spec).replace('.csv', '') for spec in specpath.glob('*.csv'))
+    if args.include:
+        slugs = [slug for slug in slugs if slug in args.include]
+    if args.exclude:
+        slugs = [slug for slug in slugs if slug not in args.exclude]
+
+    # hook files import the GIS stack, so this is only done once the arguments have been checked
+    from src.zoning.hooks import requiredFiles
+    names = []
+    for slug in slugs:
+        names += [name for name in requiredFiles(slug) if name not in names]
+
+print(f'Fetching {len(names)} files from {args.source} to {args.dest}...')
+results = fetch(source, names, args.dest, workers=args.workers, manifest=manifest)
+failed = {name: result for name, result in results.items() if result not in ('present', 'downloaded')}
+print(f'{sum(r == "downloaded" for r in results.values())} downloaded, {sum(r == "present" for r in results.values())} already present, {len(failed)} failed')
+if len(failed) > 0:
+    for name, result in sorted(failed.items()):
+        print(f'  {name}: {result}')
+    exit(1)
@@ -18,10 +18,10 @@
 from sys import argv, exit
 import os.path
 from pathlib import Path
-from argparse import ArgumentParser
+from argparse import ArgumentParser, ArgumentTypeError
 
-from src.zoning.zoneingest import ZoneIngester, schema
-from src.ingest import Collater
+# The GIS stack (geopandas, fiona, shapely) takes seconds to import, so modules that use it are imported below, only once
+# the arguments and input files have been checked
 
 print('''
  _____           _               ____
@@ -32,13 +32,47 @@ print('''
                          |___/        |_|
 ''') # thanks figlet
 
+def output (spec):
+    "Parse an additional output, DRIVER:PATH"
+    driver, sep, path = spec.partition(':')
+    if sep == '' or driver == '' or path == '':
+        raise ArgumentTypeError(f'{spec} is not of the form DRIVER:PATH')
+    return driver, path
+
+def bbox (spec):
+    "Parse a window, minx,miny,maxx,maxy in WGS 84"
+    try:
+        minx, miny, maxx, maxy = [float(v) for v in spec.split(',')]
+    except ValueError:
+        raise ArgumentTypeError(f'{spec} is not of the form minx,miny,maxx,maxy')
+    if not (-180 <= minx < maxx <= 180 and -90 <= miny < maxy <= 90):
+        raise ArgumentTypeError(f'{spec} is not a valid longitude/latitude bounding box')
+    return minx, miny, maxx, maxy
+
 parser = ArgumentParser(description='Ingest zoning data for fun and profit')
-parser.add_argument('outfile', help='Output file')
+parser.add_argument('outfile', nargs='?', help='Output file')
 parser.add_argument('--driver', default='GeoJSON', help='OGR driver for writing output')
+parser.add_argument('--sort', action='store_true', help='Write features in spatial (Hilbert curve) order')
+parser.add_argument('--partition', action='store_true', help='Write a directory with a file per jurisdiction (or tile, see --tile-size) and a manifest')
+parser.add_argument('--tile-size', type=int, metavar='N', help='With --partition, split jurisdictions into spatially contiguous tiles of at most N features')
+parser.add_argument('--also', nargs='+', type=output, metavar='DRIVER:PATH', help='Also write the output to PATH using DRIVER, in the same pass')
+parser.add_argument('--also-partitioned', nargs='+', type=output, metavar='DRIVER:DIR', help='Also write a file per jurisdiction (see --partition) to DIR using DRIVER, in the same pass')
+parser.add_argument('--feature-keys', action='store_true', help='Write a stable key for each feature, for comparing builds with diffZoning.py')
+parser.add_argument('--bbox', type=bbox, metavar='MINX,MINY,MAXX,MAXY', help='Only process features overlapping this longitude/latitude box, for quickly testing specs and hooks')
 parser.add_argument('--include', nargs='+', help='Cit(ies) to parse, default all')
 parser.add_argument('--exclude', nargs='+', help='Cit(ies) to omit')
+parser.add_argument('--check', action='store_true', help='Only check that specfiles cover the zones in the shapefiles, without writing output')
+parser.add_argument('--pipeline', action='store_true', help='Read the next city in the background while the current one is processed')
+parser.add_argument('--capacity', metavar='CSV', help='Also write a summary of zoned capacity per jurisdiction and zone to CSV')
+parser.add_argument('--compact', action='store_true', help='Use compact in-memory dtypes and drop unused source columns to reduce memory usage')
+parser.add_argument('--merge-fragments', action='store_true', help='Merge adjacent features with identical attributes (e.g. fragments left by overlays in hooks) before writing')
+parser.add_argument('--precision', type=float, metavar='METERS', help='Snap geometries to a grid of this size when reading and overlaying them, and round output coordinates to match')
+parser.add_argument('--no-cache', action='store_true', help='Recompute auxiliary layers that hooks cache between runs')
 args = parser.parse_args()
 
+if args.outfile is None and not args.check:
+    parser.error('outfile is required unless --check is specified')
+
 # identify spec files
 specpath = Path(os.path.join(os.path.dirname(argv[0]), 'src', 'zoning', 'specs'))
 specs = list(specpath.glob('*.csv'))
@@ -66,12 +100,78 @@ if len(missingStems) > 0:
     print(f'Stems f{", ".join(missingStems)} are missing zipped shapefiles.')
     exit(1)
 
+# if the data was downloaded with fetchData.py, make sure it hasn't changed since it was verified
+if os.path.exists(os.path.join(shppath, 'checksums.json')):
+    from src.ingest.fetch import Checksums
+    checksums = Checksums(shppath)
+    unverified = [slug for slug in slugs if checksums.get(os.path.join(shppath, slug + '.zip')) is None]
+    if len(unverified) > 0:
+        print(f'WARNING: zipped shapefiles for {", ".join(unverified)} have not been verified, or have changed since; run fetchData.py to verify them')
+
+# Everything below needs the GIS stack
+from src.zoning.zoneingest import ZoneIngester, schema, KEY_COLUMNS
+from src.ingest import cache, shputils
+cache.enabled = not args.no_cache
+shputils.gridSize = args.precision
+
+if args.check:
+    from src.zoning.speccheck import checkSpec
+    for slug in slugs:
+        print(f'Checking {slug}...')
+        with open(os.path.join(specpath, slug + '.csv')) as spec:
+            checkSpec(ZoneIngester(None, spec), os.path.join(shppath, slug + '.zip'))
+    exit(0)
+
 print('Initializing output...')
-with Collater(schema=schema, outfile=args.outfile, driver=args.driver) as collater:
+keyColumns = KEY_COLUMNS if args.feature_keys else None
+if args.precision is not None:
+    from src.ingest.collater import decimalPlaces
+    precision = decimalPlaces(args.precision)
+else:
+    precision = None
+
+def makeCollater (outfile, driver, partition):
+    if partition:
+        from src.ingest import PartitionedCollater
+        return PartitionedCollater(schema=schema, outdir=outfile, driver=driver, maxFeatures=args.tile_size, keyColumns=keyColumns, precision=precision)
+    elif driver == 'GPKG':
+        from src.ingest.geopackage import GeoPackageCollater
+        return GeoPackageCollater(schema=schema, outfile=outfile, sort=args.sort, keyColumns=keyColumns, precision=precision)
+    else:
+        from src.ingest import Collater
+        return Collater(schema=schema, outfile=outfile, driver=driver, sort=args.sort, keyColumns=keyColumns, precision=precision)
+
+collater = makeCollater(args.outfile, args.driver, args.partition)
+extraOutputs = [(output, False) for output in args.also or []] + [(output, True) for output in args.also_partitioned or []]
+if len(extraOutputs) > 0:
+    from src.ingest import MultiCollater
+    collater = MultiCollater([collater] + [makeCollater(outfile, driver, partition) for (driver, outfile), partition in extraOutputs])
+if args.capacity:
+    from src.zoning.capacity import CapacityAggregator
+    collater = CapacityAggregator(collater, args.capacity)
+
+with collater:
     print(f'collater: {collater}')
     print('Reading slugs...')
-    for slug in slugs:
-        print(f'  Reading {slug}...')
-        with open(os.path.join(specpath, slug + '.csv')) as spec:
-            ingester = ZoneIngester(collater, spec)
-            ingester.ingest(slug)
+    if args.pipeline:
+        from src.ingest.pipeline import ingestPipelined
+        jobs = []
+        for slug in slugs:
+            with open(os.path.join(specpath, slug + '.csv')) as spec:
+                jobs.append((slug, ZoneIngester(collater, spec, compact=args.compact, window=args.bbox, merge=args.merge_fragments)))
+        ingestPipelined(jobs)
+    else:
+        jobs = []
+        for slug in slugs:
+            print(f'  Reading {slug}...')
+            with open(os.path.join(specpath, slug + '.csv')) as spec:
+                ingester = ZoneIngester(collater, spec, compact=args.compact, window=args.bbox, merge=args.merge_fragments)
+                ingester.ingest(slug)
+                jobs.append((slug, ingester))
+
+if args.merge_fragments:
+    print('Features before and after merging fragments:')
+    for slug, ingester in jobs:
+        if ingester.mergeCounts is not None:
+            before, after = ingester.mergeCounts
+            print(f'  {slug}: {before} -> {after} ({1 - after / max(before, 1):.1%} fewer)')
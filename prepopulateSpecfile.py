@@ -18,21 +18,15 @@ Generate a skeletal zone definition file from the given shapefile.
 # limitations under the License.
 
 
-import geopandas as gp
 import re
 import csv
 from tempfile import mkdtemp
 from shutil import rmtree
-from os.path import basename, join, dirname
+from os.path import basename, join, dirname, exists
 from time import strftime
 from collections import defaultdict
 from zipfile import ZipFile
 from argparse import ArgumentParser
-import numpy as np
-import shapely.ops
-
-from src.zoning.zoneingest import variables
-from src.zoning.hooks import runHook
 
 parser = ArgumentParser(description='Prepolate lookup table')
 parser.add_argument('slug', metavar='slug', help='Slug for this dataset')
@@ -41,12 +35,21 @@ parser.add_argument('--drop-small-zones', metavar='MIN_ZONE_SIZE', type=float, h
 parser.add_argument('--imperial', action='store_true', help='Write specfile column names in imperial units')
 args = parser.parse_args()
 
+datapath = join(dirname(__file__), 'data', 'zoning')
+shpzip = join(datapath, args.slug + '.zip')
+if not exists(shpzip):
+    parser.error(f'No zipped shapefile found for {args.slug} at {shpzip}')
+
+# the GIS stack is slow to import, so wait until the arguments have been checked
+import geopandas as gp
+from src.zoning.zoneingest import variables
+from src.zoning.hooks import runHook
+from src.ingest.shputils import EQUAL_AREA_CRS
+
 print('Reading data')
 # TODO move this code into a module
 tmp = mkdtemp()
 
-datapath = join(dirname(__file__), 'data', 'zoning')
-shpzip = join(datapath, args.slug + '.zip')
 print(f'    Extracting shapefile {shpzip}...')
 with open(shpzip, 'rb') as raw:
     zf = ZipFile(raw)
@@ -96,7 +99,7 @@ if args.drop_small_zones is not None:
     print(f'    Removing zones smaller than {args.drop_small_zones} square km...')
     minSizeSqM = args.drop_small_zones * (1000 ** 2) # convert to sq km
     # project to equal area projection for area calculation
-    projected = shp[~shp.geometry.isnull()].to_crs('+proj=aea +lat_1=29.5 +lat_2=45.5 +lat_0=37.5 +lon_0=-96 +x_0=0 +y_0=0 +datum=NAD83 +units=m +no_defs')
+    projected = shp[~shp.geometry.isnull()].to_crs(EQUAL_AREA_CRS)
     dissolve = projected.dissolve(cols)
     includeZones = dissolve[dissolve.area > minSizeSqM].index
     if len(cols) != 1:
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# Rasterize zoning attributes onto a grid, for fast regional analysis
+
+# Copyright 2018 Zoning.Space contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os.path
+from argparse import ArgumentParser
+
+parser = ArgumentParser(description='Rasterize zoning attributes onto a grid in an equal-area projection')
+parser.add_argument('zoning', help='Processed zoning, as written by loadZoning.py')
+parser.add_argument('outdir', help='Directory to write rasters and a manifest to')
+parser.add_argument('--columns', nargs='+', required=True, metavar='COLUMN', help='Zoning attributes to rasterize, e.g. hiMaxUnitsPerHectare multiFamily')
+parser.add_argument('--cell-size', type=float, default=30, metavar='METERS', help='Size of grid cells')
+parser.add_argument('--format', choices=['npy', 'npz', 'gtiff'], default='npy',
+    help='npy: a memory-mappable array per attribute; npz: compressed tiles; gtiff: a tiled, compressed GeoTIFF per attribute (requires GDAL)')
+parser.add_argument('--tile-size', type=int, default=1024, metavar='CELLS', help='Width and height of the tiles rasterized by each worker')
+parser.add_argument('--workers', type=int, help='Number of worker processes, default the number of CPUs')
+args = parser.parse_args()
+
+if not os.path.exists(args.zoning):
+    parser.error(f'{args.zoning} does not exist')
+if args.cell_size <= 0:
+    parser.error('--cell-size must be positive')
+
+# the GIS stack is slow to import, so wait until the arguments have been checked
+import geopandas as gp
+from src.zoning.raster import rasterizeZoning
+
+print(f'Reading zoning from {args.zoning}...')
+zoning = gp.read_file(args.zoning)
+missing = [col for col in args.columns if col not in zoning.columns]
+if len(missing) > 0:
+    parser.error(f'Zoning has no column(s) {", ".join(missing)}')
+
+print('Rasterizing...')
+rasterizeZoning(zoning, args.outdir, args.columns, cellSize=args.cell_size, fmt=args.format, tileSize=args.tile_size, workers=args.workers)
+print(f'Wrote rasters to {args.outdir}')
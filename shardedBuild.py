@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+# Build zoning across many worker processes or hosts that share a directory
+#
+# 1. shardedBuild.py publish QUEUEDIR publishes a work item for each city (or chunk of a large city)
+# 2. shardedBuild.py work QUEUEDIR, run on any number of hosts, processes items until none are left
+# 3. shardedBuild.py collate QUEUEDIR OUTFILE writes the results to a single output, in a deterministic order
+
+# Copyright 2018 Zoning.Space contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os.path
+from sys import argv, exit
+from pathlib import Path
+from argparse import ArgumentParser, ArgumentTypeError
+
+# The GIS stack is slow to import, so modules that use it are imported below, once the arguments have been checked
+
+def grid (spec):
+    "Parse SLUG=N"
+    slug, sep, n = spec.partition('=')
+    try:
+        n = int(n)
+    except ValueError:
+        n = 0
+    if sep == '' or slug == '' or n < 1:
+        raise ArgumentTypeError(f'{spec} is not of the form SLUG=N')
+    return slug, n
+
+parser = ArgumentParser(description='Build zoning across many worker processes or hosts that share a directory')
+commands = parser.add_subparsers(dest='command')
+
+publish = commands.add_parser('publish', help='Publish a work item for each city, or each chunk of large cities')
+publish.add_argument('queuedir', help='Shared directory for the work queue and intermediate outputs')
+publish.add_argument('--include', nargs='+', help='Cit(ies) to build, default all')
+publish.add_argument('--exclude', nargs='+', help='Cit(ies) to omit')
+publish.add_argument('--grid', nargs='+', type=grid, default=[], metavar='SLUG=N', help='Split these cities into an N x N grid of chunks, processed separately')
+
+work = commands.add_parser('work', help='Process work items until there are none left')
+work.add_argument('queuedir', help='Shared directory for the work queue and intermediate outputs')
+work.add_argument('--processes', type=int, default=1, metavar='N', help='Number of worker processes to run on this host')
+work.add_argument('--lease', type=float, default=300, metavar='SECONDS', help='How long a claim on an item lasts without being renewed')
+work.add_argument('--compact', action='store_true', help='Use compact in-memory dtypes (see loadZoning.py)')
+work.add_argument('--merge-fragments', action='store_true', help='Merge adjacent features with identical attributes (see loadZoning.py)')
+work.add_argument('--precision', type=float, metavar='METERS', help='Snap geometries to a grid of this size (see loadZoning.py)')
+work.add_argument('--no-cache', action='store_true', help='Recompute auxiliary layers that hooks cache between runs')
+
+status = commands.add_parser('status', help='Show the state of the work items')
+status.add_argument('queuedir', help='Shared directory for the work queue and intermediate outputs')
+
+retry = commands.add_parser('retry', help='Return failed items to the queue')
+retry.add_argument('queuedir', help='Shared directory for the work queue and intermediate outputs')
+
+collate = commands.add_parser('collate', help='Write the results of all items to a single output')
+collate.add_argument('queuedir', help='Shared directory for the work queue and intermediate outputs')
+collate.add_argument('outfile', help='Output file')
+collate.add_argument('--driver', default='GeoJSON', help='OGR driver for writing output')
+collate.add_argument('--sort', action='store_true', help='Write features in spatial (Hilbert curve) order')
+collate.add_argument('--feature-keys', action='store_true', help='Write a stable key for each feature, for comparing builds with diffZoning.py')
+collate.add_argument('--precision', type=float, metavar='METERS', help='Round output coordinates to match a grid of this size (use the same value as for work)')
+collate.add_argument('--capacity', metavar='CSV', help='Also write a summary of zoned capacity per jurisdiction and zone to CSV')
+
+# guarded, since worker processes started with the spawn start method import this module (see work below)
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    if args.command is None:
+        parser.error('a command is required')
+
+    if args.command != 'publish' and not os.path.exists(os.path.join(args.queuedir, 'queue.sqlite')):
+        parser.error(f'{args.queuedir} has no work queue, run publish first')
+
+    if args.command == 'publish':
+        specpath = Path(os.path.join(os.path.dirname(argv[0]), 'src', 'zoning', 'specs'))
+        slugs = sorted(os.path.basename(spec).replace('.csv', '') for spec in specpath.glob('*.csv'))
+        if args.include:
+            slugs = [slug for slug in slugs if slug in args.include]
+        if args.exclude:
+            slugs = [slug for slug in slugs if slug not in args.exclude]
+
+        shppath = os.path.join(os.path.dirname(argv[0]), 'data', 'zoning')
+        missing = [slug for slug in slugs if not os.path.exists(os.path.join(shppath, slug + '.zip'))]
+        if len(missing) > 0:
+            parser.error(f'Stems {", ".join(missing)} are missing zipped shapefiles')
+        grids = dict(args.grid)
+        unknown = [slug for slug in grids if slug not in slugs]
+        if len(unknown) > 0:
+            parser.error(f'--grid refers to cities that are not being built: {", ".join(unknown)}')
+
+        from src.zoning.sharded import publish
+        print(f'Published {publish(args.queuedir, slugs, grids)} work items for {len(slugs)} cities')
+
+    elif args.command == 'work':
+        from multiprocessing import Process
+        from src.zoning.sharded import runWorker
+        # passed explicitly, since with the spawn start method (the default on macOS and Windows) worker processes don't
+        # inherit this process's state
+        workerArgs = (args.queuedir, args.compact, args.merge_fragments, args.lease, args.precision, not args.no_cache)
+
+        if args.processes == 1:
+            runWorker(*workerArgs)
+        else:
+            processes = [Process(target=runWorker, args=workerArgs) for i in range(args.processes)]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+
+    elif args.command == 'status':
+        from src.ingest.workqueue import WorkQueue, FAILED
+        with WorkQueue(os.path.join(args.queuedir, 'queue.sqlite')) as queue:
+            for state, count in sorted(queue.counts().items()):
+                print(f'{state}: {count}')
+            for item in queue.items():
+                if item.state == FAILED:
+                    print(f'\n{item.slug} chunk {item.chunk} failed after {item.attempts} attempts:\n{item.error}')
+
+    elif args.command == 'retry':
+        from src.ingest.workqueue import WorkQueue
+        with WorkQueue(os.path.join(args.queuedir, 'queue.sqlite')) as queue:
+            queue.reset()
+            print(', '.join(f'{state}: {count}' for state, count in sorted(queue.counts().items())))
+
+    elif args.command == 'collate':
+        from src.zoning.zoneingest import schema, KEY_COLUMNS
+        from src.zoning.sharded import collate as collateItems
+        keyColumns = KEY_COLUMNS if args.feature_keys else None
+        if args.precision is not None:
+            from src.ingest.collater import decimalPlaces
+            precision = decimalPlaces(args.precision)
+        else:
+            precision = None
+
+        if args.driver == 'GPKG':
+            from src.ingest.geopackage import GeoPackageCollater
+            collater = GeoPackageCollater(schema=schema, outfile=args.outfile, sort=args.sort, keyColumns=keyColumns, precision=precision)
+        else:
+            from src.ingest import Collater
+            collater = Collater(schema=schema, outfile=args.outfile, driver=args.driver, sort=args.sort, keyColumns=keyColumns, precision=precision)
+        if args.capacity:
+            from src.zoning.capacity import CapacityAggregator
+            collater = CapacityAggregator(collater, args.capacity)
+
+        # errors pass through the with statement, so that the collater knows the output is incomplete
+        try:
+            with collater:
+                collateItems(args.queuedir, collater)
+        except ValueError as e:
+            print(e)
+            exit(1)
@@ -16,5 +16,5 @@ Defines generic functions for ingesting disparate data sources and combining the
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from .collater import Collater
+from .collater import Collater, PartitionedCollater, MultiCollater
 from .ingester import Ingester
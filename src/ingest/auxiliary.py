@@ -0,0 +1,96 @@
+# Load the auxiliary layers that hooks use (e.g. height districts or transit stops) concurrently, in a pool of threads,
+# while the main shapefile is being read. Hooks declare their layers up front, and receive them already loaded and
+# reprojected.
+
+# Copyright 2018 Zoning.Space contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from os.path import join
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from .shputils import readZippedShapefile, bufferWindow, snapFrame
+from .validity import repairFrame
+
+# Number of layers loaded at once
+MAX_WORKERS = 4
+
+_executor = None
+_executorLock = Lock()
+
+def executor ():
+    "The thread pool used to load layers, shared by all ingesters so that loading can overlap across cities"
+    global _executor
+    with _executorLock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='zoning-auxiliary')
+        return _executor
+
+def shapefile (filename, epsg=None, margin=0):
+    """
+    Declare a zipped shapefile in the data directory as an auxiliary layer, reprojected to epsg if specified, with any
+    invalid geometries repaired. When processing a window, features within margin meters of it are read.
+    """
+    def load (datadir, window):
+        data, repaired = repairFrame(readZippedShapefile(join(datadir, filename), bbox=bufferWindow(window, margin)))
+        if repaired.any():
+            print(f'      Repaired {repaired.sum()} invalid geometries in {filename}')
+            data = data[data.geometry.notnull()]
+        # snapped only once repaired, since snapping invalid geometries fails
+        data = snapFrame(data)
+        return data.to_crs(epsg=epsg) if epsg is not None else data
+    load.files = [filename]
+    return load
+
+def derived (filenames, compute):
+    """
+    Declare an auxiliary layer computed from files in the data directory, e.g. by a cached function. compute receives the
+    paths of the files, followed by the window (or None).
+    """
+    def load (datadir, window):
+        return compute(*[join(datadir, filename) for filename in filenames], window)
+    load.files = list(filenames)
+    return load
+
+def auxiliaryFiles (declarations):
+    "Names of the files in the data directory used by auxiliary layer declarations, e.g. so that they can be downloaded"
+    files = []
+    for name, loader in declarations.items():
+        if hasattr(loader, 'files'):
+            files += [f for f in loader.files if f not in files]
+        else:
+            print(f'WARNING: auxiliary layer {name} does not declare the files it uses (see shapefile() and derived())')
+    return files
+
+class Layers (object):
+    "Auxiliary layers being loaded in the background. Getting a layer waits for it to finish loading."
+    def __init__ (self, futures):
+        self.futures = futures
+
+    def __getitem__ (self, name):
+        return self.futures[name].result()
+
+    def __contains__ (self, name):
+        return name in self.futures
+
+    def keys (self):
+        return self.futures.keys()
+
+def loadLayers (declarations, datadir, window=None):
+    """
+    Start loading auxiliary layers. declarations is a dict from layer names to loaders, functions taking the data
+    directory and the window (or None) and returning a data frame, such as those returned by shapefile().
+    """
+    pool = executor()
+    return Layers({name: pool.submit(loader, datadir, window) for name, loader in declarations.items()})
@@ -0,0 +1,165 @@
+# Cache expensive intermediate results (e.g. auxiliary layers derived in hooks) on disk between runs. A cached function
+# is keyed on a hash of its source code, the contents of the input files it declares, its other arguments and the
+# precision model (see shputils.gridSize), so the cache is invalidated automatically when either the code or the data
+# changes. Entries are stored in the shared-memory transport format (see transport.py) under data/cache, and the least
+# recently used entries are evicted when the cache grows beyond MAX_CACHE_BYTES.
+
+# Copyright 2018 Zoning.Space contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import inspect
+import hashlib
+import marshal
+import functools
+from os.path import join, dirname, exists, getsize
+from shutil import rmtree
+from tempfile import mkdtemp
+import pandas as pd
+
+from .transport import packFrame, SharedFrame
+from .fetch import Checksums
+from . import shputils
+
+CACHE_DIR = os.environ.get('ZONING_CACHE_DIR', join(dirname(__file__), '..', '..', 'data', 'cache'))
+
+# Evict least recently used entries when the cache is larger than this
+MAX_CACHE_BYTES = 2 * 1024 ** 3
+
+# Set to False to always recompute (e.g. loadZoning.py --no-cache)
+enabled = True
+
+# file hashes, keyed on path, modification time and size, so each input is only read once per run
+_fileHashes = {}
+
+def fileHash (filename):
+    "SHA-256 of the contents of a file, taken from the checksums recorded when it was downloaded (see fetch.py) if possible"
+    stat = os.stat(filename)
+    key = (os.path.abspath(filename), stat.st_mtime_ns, stat.st_size)
+    if key not in _fileHashes:
+        _fileHashes[key] = Checksums(dirname(os.path.abspath(filename))).get(filename)
+    if _fileHashes[key] is None:
+        digest = hashlib.sha256()
+        with open(filename, 'rb') as raw:
+            for chunk in iter(lambda: raw.read(1024 * 1024), b''):
+                digest.update(chunk)
+        _fileHashes[key] = digest.hexdigest()
+    return _fileHashes[key]
+
+def functionSource (func):
+    "The source code of a function, or its compiled code if the source is not available"
+    try:
+        return inspect.getsource(func).encode('utf-8')
+    except (OSError, TypeError):
+        return marshal.dumps(func.__code__)
+
+def cacheKey (func, files, arguments):
+    "Hash of a function's source, the contents of the named input files among its arguments, and its other arguments"
+    digest = hashlib.sha256()
+    digest.update(func.__qualname__.encode('utf-8'))
+    digest.update(functionSource(func))
+    # geometries read inside the function depend on the precision model
+    digest.update(f'gridSize={shputils.gridSize!r}\x1f'.encode('utf-8'))
+    for name, value in sorted(arguments.items()):
+        if name in files:
+            value = fileHash(value)
+        elif value is not None and not isinstance(value, (str, int, float, bool, tuple, list)):
+            raise TypeError(f'Cannot cache {func.__qualname__}: argument {name} is a {type(value).__name__}, not a file or simple value')
+        digest.update(f'{name}={value!r}\x1f'.encode('utf-8'))
+    return digest.hexdigest()
+
+def directorySize (directory):
+    size = 0
+    for root, dirs, filenames in os.walk(directory):
+        for f in filenames:
+            try:
+                size += getsize(join(root, f))
+            except OSError:
+                pass # removed by another process meanwhile
+    return size
+
+def evict (maxBytes=MAX_CACHE_BYTES):
+    "Remove least recently used cache entries until the cache is smaller than maxBytes"
+    if not exists(CACHE_DIR):
+        return
+    # entries being written by other processes are skipped, and entries may be evicted by other processes while we look
+    lastUsed = {}
+    for e in os.listdir(CACHE_DIR):
+        if '.tmp' not in e:
+            try:
+                lastUsed[join(CACHE_DIR, e)] = os.stat(join(CACHE_DIR, e, 'meta.pickle')).st_mtime
+            except OSError:
+                pass
+    entries = sorted(lastUsed, key=lambda e: lastUsed[e])
+    sizes = [directorySize(e) for e in entries]
+    total = sum(sizes)
+    for entry, size in zip(entries, sizes):
+        if total <= maxBytes:
+            break
+        print(f'      evicting cache entry {os.path.basename(entry)}')
+        rmtree(entry, ignore_errors=True)
+        total -= size
+
+def cached (files=()):
+    """
+    Decorator to cache the data frame returned by a function on disk. files lists the names of arguments that are paths
+    to input files; the cache is keyed on their contents. Other arguments must be simple values (strings, numbers, etc.)
+    and are keyed on their values. Only the source of the decorated function itself is hashed, so computations that
+    should be invalidated when the code changes belong inside it, not in helper functions it calls.
+    """
+    def decorator (func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper (*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = cacheKey(func, files, bound.arguments)
+            entry = join(CACHE_DIR, f'{func.__name__}-{key[:24]}')
+
+            if exists(join(entry, 'meta.pickle')):
+                print(f'      using cached {func.__name__}')
+                os.utime(join(entry, 'meta.pickle')) # mark as recently used
+                return SharedFrame(entry).toFrame()
+
+            result = func(*args, **kwargs)
+            if not isinstance(result, pd.DataFrame):
+                raise TypeError(f'Cannot cache {func.__qualname__}: it returned a {type(result).__name__}, not a data frame')
+
+            # pack into a temporary directory and rename, so that an interrupted run never leaves a partial entry. Other
+            # processes or threads may compute the same entry at the same time; the first to rename wins, and an existing
+            # entry is never replaced, since someone else may be reading it.
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            tmp = mkdtemp(prefix=f'{os.path.basename(entry)}.tmp', dir=CACHE_DIR)
+            try:
+                packFrame(result, tmp)
+                if not exists(entry):
+                    os.rename(tmp, entry)
+            except OSError:
+                if not exists(join(entry, 'meta.pickle')):
+                    raise
+                # someone else won
+            finally:
+                if exists(tmp):
+                    rmtree(tmp)
+            evict()
+            return result
+
+        return wrapper
+
+    return decorator
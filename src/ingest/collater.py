@@ -21,17 +21,58 @@ context managers.
 import fiona
 import shapely.geometry
 import numpy as np
+import pandas as pd
+import json
+import math
+import re
+import os
+from os.path import join
+
+from .spatialsort import hilbertSort
+from .shputils import snapGeometries, METERS_PER_DEGREE
+from .featurekeys import featureKeys
+
+# Column that stable feature keys are written to
+KEY_FIELD = 'featureKey'
 
 CRS = { 'init': 'epsg:4326' } # WGS 84
 
 INFINITY = 2147438647 # maxint for 32 bit int
 
+# File extensions for common drivers, used when writing partitioned output
+EXTENSIONS = {
+    'GeoJSON': '.geojson',
+    'ESRI Shapefile': '.shp',
+    'GPKG': '.gpkg'
+}
+
+# Directory that features with no value in the partitionBy column are written to in partitioned output
+NULL_PARTITION = 'none'
+
+def decimalPlaces (meters):
+    "Number of decimal places of longitude and latitude needed to represent a distance in meters"
+    return max(0, math.ceil(-math.log10(meters / METERS_PER_DEGREE)))
+
 class Collater (object):
-    def __init__ (self, schema, outfile, driver='GeoJSON'):
-        "schema is a fiona schema, see http://toblerity.org/fiona/manual.html#writing-vector-data"
+    # Whether write() uses Fiona records, which MultiCollater converts once and shares between sinks
+    usesRecords = True
+
+    def __init__ (self, schema, outfile, driver='GeoJSON', sort=False, keyColumns=None, precision=None):
+        """
+        schema is a fiona schema, see http://toblerity.org/fiona/manual.html#writing-vector-data. If sort is true,
+        the features from each call to collate() are written in order along a Hilbert curve. If keyColumns is
+        specified, a stable key based on those columns and the geometry is written to the featureKey column. If
+        precision is specified, coordinates are rounded to that many decimal places, which makes text output smaller.
+        """
         self.schema = schema
+        self.keyColumns = keyColumns
+        if keyColumns is not None:
+            self.schema = dict(schema, properties=dict(schema['properties']))
+            self.schema['properties'][KEY_FIELD] = 'str'
         self.outfilename = outfile
         self.driver = driver
+        self.sort = sort
+        self.precision = precision
         self.out = None
 
     def __enter__ (self):
@@ -42,7 +83,13 @@ class Collater (object):
         self.close()
 
     def open (self):
-        self.out = fiona.open(self.outfilename, 'w', driver=self.driver, crs=CRS, schema=self.schema)
+        self.out = fiona.open(self.outfilename, 'w', driver=self.driver, crs=CRS, schema=self.schema, **self.layerOptions())
+
+    def layerOptions (self):
+        "Driver-specific options for Fiona"
+        if self.precision is not None and self.driver == 'GeoJSON':
+            return {'COORDINATE_PRECISION': self.precision}
+        return {}
 
     def close (self):
         if self.out is not None:
@@ -52,26 +99,53 @@ class Collater (object):
         if self.out is None:
             raise Exception('Collater has not been opened (call open() or use a with statement).')
 
-        if not set(self.schema['properties'].keys()).issubset(data.columns):
+        self.write(self.prepare(data))
+
+    def prepare (self, data):
+        "Check and project data for writing"
+        required = set(self.schema['properties'].keys())
+        if self.keyColumns is not None:
+            required.discard(KEY_FIELD) # computed below
+        if not required.issubset(data.columns):
             raise ValueError('Not all columns in schema are in data frame!')
 
+        if self.sort:
+            data = hilbertSort(data)
+
         projected = data.to_crs(CRS)
 
-        def fiona_records_gen():
-            for index, row in projected.iterrows():
-                yield self.toFionaRecord(row)
+        if self.precision is not None:
+            # snap rather than just rounding when writing, so that geometries stay valid
+            projected['geometry'] = snapGeometries(projected.geometry.values, 10 ** -self.precision)
+
+        if self.keyColumns is not None:
+            # computed in the output projection so keys are comparable across builds
+            projected[KEY_FIELD] = featureKeys(projected, self.keyColumns)
 
-        self.out.writerecords(fiona_records_gen())
+        return projected
+
+    def write (self, projected, records=None):
+        "Write data that has already been prepared, using the corresponding Fiona records if they have been converted already"
+        self.writeRecords(self.out, projected, records)
+
+    def records (self, projected):
+        "Convert prepared data to Fiona records"
+        for index, row in projected.iterrows():
+            yield self.toFionaRecord(row)
+
+    def writeRecords (self, out, projected, records=None):
+        out.writerecords(records if records is not None else self.records(projected))
 
     # convert NaNs to Nones, which will be written as nulls. The JSON spec doesn't allow NaNs and Infinities, but fiona
     # is happy to write them anyhow
     # TODO the Infinities mean something - how to carry them through into output?
     def processValue (self, val):
-        if type(val) == float:
+        if isinstance(val, (float, np.floating)):
             if np.isnan(val):
                 return None
             if not np.isfinite(val):
                 return INFINITY
+            return float(val) # float32 values from compacted frames
         return val
 
     def toFionaRecord (self, row):
@@ -85,3 +159,145 @@ class Collater (object):
                 },
             'geometry': shapely.geometry.mapping(row.geometry)
         }
+
+class PartitionedCollater (Collater):
+    """
+    Writes output to a directory, with a subdirectory for each value of the partitionBy column (e.g. jurisdiction).
+    Features are sorted along a Hilbert curve and, if maxFeatures is specified, split into tiles of at most maxFeatures
+    contiguous features along the curve. A manifest.json lists each file with its partition and extent, so that readers
+    need only open the files that overlap the area they are interested in.
+    """
+    def __init__ (self, schema, outdir, driver='GeoJSON', partitionBy='jurisdiction', maxFeatures=None, keyColumns=None, precision=None):
+        super().__init__(schema, outdir, driver=driver, sort=True, keyColumns=keyColumns, precision=precision)
+        self.partitionBy = partitionBy
+        self.maxFeatures = maxFeatures
+        self.manifest = None
+
+    def open (self):
+        os.makedirs(self.outfilename, exist_ok=True)
+        self.manifest = []
+        self.directories = {} # partition -> directory
+
+    def close (self):
+        if self.manifest is not None:
+            with open(join(self.outfilename, 'manifest.json'), 'w') as out:
+                json.dump({'crs': CRS, 'driver': self.driver, 'partitionBy': self.partitionBy, 'files': self.manifest}, out, indent=2)
+            self.manifest = None
+
+    def collate (self, data):
+        if self.manifest is None:
+            raise Exception('Collater has not been opened (call open() or use a with statement).')
+
+        self.write(self.prepare(data))
+
+    def write (self, projected, records=None):
+        # group positions rather than rows, so that records converted elsewhere can be split up the same way. Group on
+        # codes rather than values, so that missing values (code -1) form a partition of their own rather than being dropped
+        codes, partitions = pd.factorize(np.asarray(projected[self.partitionBy].values, dtype=object), sort=True)
+        positions = pd.Series(np.arange(len(projected))).groupby(codes, sort=True)
+
+        # groupby preserves the Hilbert order within each partition
+        for code, group in positions:
+            partition = partitions[code] if code >= 0 else None
+            if partition is None:
+                print(f'  {len(group)} features have no {self.partitionBy}, writing them to {self.directory(None)}')
+            group = group.values
+            tileSize = self.maxFeatures if self.maxFeatures is not None else len(group)
+            for start in range(0, len(group), tileSize):
+                tile = group[start:start + tileSize]
+                self.writeTile(partition, projected.iloc[tile], [records[i] for i in tile] if records is not None else None)
+
+    def directory (self, partition):
+        "Directory for a partition (None for missing values), with a suffix if another partition's name maps to the same one"
+        if partition not in self.directories:
+            base = re.sub(r'[^A-Za-z0-9]+', '-', partition).strip('-').lower() if partition is not None else NULL_PARTITION
+            base = base if base != '' else 'partition'
+            directory = base
+            suffix = 2
+            while directory in self.directories.values():
+                directory = f'{base}-{suffix}'
+                suffix += 1
+            self.directories[partition] = directory
+        return self.directories[partition]
+
+    def writeTile (self, partition, tile, records=None):
+        partition = str(partition) if partition is not None else None
+        directory = self.directory(partition)
+        os.makedirs(join(self.outfilename, directory), exist_ok=True)
+        # number tiles consecutively within each partition
+        tileNumber = len([f for f in self.manifest if f['partition'] == partition])
+        filename = join(directory, f'{tileNumber:04d}{EXTENSIONS.get(self.driver, "")}')
+
+        with fiona.open(join(self.outfilename, filename), 'w', driver=self.driver, crs=CRS, schema=self.schema, **self.layerOptions()) as out:
+            self.writeRecords(out, tile, records)
+
+        self.manifest.append({
+            'file': filename,
+            'partition': partition,
+            'tile': tileNumber,
+            'features': len(tile),
+            'bounds': [float(b) for b in tile.total_bounds]
+        })
+
+class MultiCollater (Collater):
+    """
+    Writes the same data to several collaters (sinks) at once, e.g. a merged file and per-jurisdiction files in another
+    format. Each data frame is checked, sorted, projected and keyed once, and converted to Fiona records once, and the
+    result is handed to every sink. The sinks must have the same schema, key columns and precision. If any sink sorts its
+    output, all sinks receive sorted data.
+    """
+    def __init__ (self, sinks):
+        if len(sinks) == 0:
+            raise ValueError('At least one sink is required')
+        if any((sink.schema, sink.keyColumns, sink.precision) != (sinks[0].schema, sinks[0].keyColumns, sinks[0].precision) for sink in sinks):
+            raise ValueError('All sinks must have the same schema, key columns and precision')
+        super().__init__(sinks[0].schema, None, sort=any(sink.sort for sink in sinks), keyColumns=sinks[0].keyColumns, precision=sinks[0].precision)
+        self.schema = sinks[0].schema # already includes the key column, if any
+        self.sinks = sinks
+        self.isOpen = False
+
+    def open (self):
+        for i, sink in enumerate(self.sinks):
+            try:
+                sink.open()
+            except BaseException as e:
+                # close the sinks that were already opened
+                self.closeSinks(self.sinks[:i], lambda sink: sink.__exit__(type(e), e, e.__traceback__), quiet=True)
+                raise
+        self.isOpen = True
+
+    def __exit__ (self, exception_type, exception_value, traceback):
+        # passed on, so that sinks can tell they are being closed because of an error (see GeoPackageCollater)
+        self.closeSinks(self.sinks, lambda sink: sink.__exit__(exception_type, exception_value, traceback), quiet=exception_type is not None)
+        self.isOpen = False
+
+    def close (self):
+        self.closeSinks(self.sinks, lambda sink: sink.close())
+        self.isOpen = False
+
+    def closeSinks (self, sinks, close, quiet=False):
+        """
+        Close every sink, even if closing one fails, and raise the first error. If quiet, errors are only printed, so they
+        don't hide an error that is already being raised.
+        """
+        error = None
+        for sink in sinks:
+            try:
+                close(sink)
+            except BaseException as e:
+                if error is None and not quiet:
+                    error = e
+                else:
+                    print(f'  WARNING: failed to close {sink.outfilename}: {e}')
+        if error is not None:
+            raise error
+
+    def collate (self, data):
+        if not self.isOpen:
+            raise Exception('Collater has not been opened (call open() or use a with statement).')
+
+        projected = self.prepare(data)
+        # converting to Fiona records is the slowest part of writing, so only do it once
+        records = list(self.records(projected)) if sum(sink.usesRecords for sink in self.sinks) > 1 else None
+        for sink in self.sinks:
+            sink.write(projected, records)
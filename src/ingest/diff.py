@@ -0,0 +1,145 @@
+# Compare two builds of the output, feature by feature. Features are matched by their stable keys (see featurekeys.py)
+# using hash joins; only features whose keys do not match are compared geometrically.
+
+# Copyright 2018 Zoning.Space contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import numpy as np
+import pandas as pd
+import geopandas as gp
+
+from .collater import CRS, KEY_FIELD
+from .featurekeys import featureKeys
+
+# Minimum intersection over union for a removed and an added feature to be considered the same feature, reshaped
+MIN_OVERLAP = 0.5
+
+CHANGES = ['unchanged', 'attributes', 'geometry', 'added', 'removed']
+
+def readBuild (filename, keyColumns):
+    "Read a build, computing feature keys if it was not written with them"
+    data = gp.read_file(filename)
+    if KEY_FIELD not in data.columns:
+        print(f'  {filename} has no feature keys, computing them')
+        data = data.to_crs(CRS)
+        data[KEY_FIELD] = featureKeys(data, keyColumns)
+    return data
+
+def withOccurrence (data):
+    "Add a column numbering features with duplicate keys, so that keys plus occurrence are unique"
+    data = data.copy()
+    data['occurrence'] = data.groupby(KEY_FIELD).cumcount()
+    return data
+
+def overlap (a, b):
+    "Intersection over union of two geometries"
+    union = a.union(b).area
+    return a.intersection(b).area / union if union > 0 else 0
+
+def matchGeometries (removed, added):
+    """
+    For each removed feature, find the added feature in the same partition that overlaps it most, if the intersection
+    over union is at least MIN_OVERLAP. Returns an array of positions in added (-1 if no match), and a boolean array of
+    which added features were matched by any removed feature.
+    """
+    matches = np.full(len(removed), -1, dtype=np.int64)
+    matched = np.zeros(len(added), dtype=bool)
+    if len(removed) == 0 or len(added) == 0:
+        return matches, matched
+
+    sindex = added.sindex
+    for i, geom in enumerate(removed.geometry.values):
+        if geom is None:
+            continue
+        best = (MIN_OVERLAP, -1)
+        for j in sindex.intersection(geom.bounds):
+            candidate = added.geometry.values[j]
+            if candidate is not None:
+                best = max(best, (overlap(geom, candidate), j))
+        if best[1] >= 0:
+            matches[i] = best[1]
+            matched[best[1]] = True
+
+    return matches, matched
+
+def valuesDiffer (before, after):
+    "Whether each pair of values differs, treating two missing values as equal"
+    before = pd.Series(before).reset_index(drop=True)
+    after = pd.Series(after).reset_index(drop=True)
+    return ~((before == after).values | (pd.isnull(before) & pd.isnull(after)).values)
+
+def diffBuilds (old, new, keyColumns, partitionBy='jurisdiction'):
+    """
+    Compare two builds (GeoDataFrames with feature keys). Returns a data frame with a row for each change, with columns
+    partition, change (one of CHANGES), oldKey, newKey, and columns (the names of changed attribute columns).
+    """
+    attributes = [col for col in old.columns if col in new.columns and col not in (KEY_FIELD, old.geometry.name)]
+
+    old = withOccurrence(old)
+    new = withOccurrence(new)
+
+    # hash join on keys
+    joined = old[[KEY_FIELD, 'occurrence', partitionBy] + [c for c in attributes if c != partitionBy]]\
+        .merge(new[[KEY_FIELD, 'occurrence'] + [c for c in attributes if c != partitionBy]],
+            on=[KEY_FIELD, 'occurrence'], how='inner', suffixes=('_old', '_new'))
+
+    # compare attributes column by column
+    compared = [col for col in attributes if col != partitionBy]
+    differs = np.zeros((len(joined), len(compared)), dtype=bool)
+    for i, col in enumerate(compared):
+        differs[:, i] = valuesDiffer(joined[col + '_old'], joined[col + '_new'])
+
+    changedColumns = [','.join(np.array(compared)[row]) if row.any() else '' for row in differs]
+    changes = list(zip(
+        joined[partitionBy].values,
+        np.where(differs.any(axis=1), 'attributes', 'unchanged'),
+        joined[KEY_FIELD].values,
+        joined[KEY_FIELD].values,
+        changedColumns
+    ))
+
+    # geometric fallback for features whose keys differ
+    oldOnly = old[~old.set_index([KEY_FIELD, 'occurrence']).index.isin(new.set_index([KEY_FIELD, 'occurrence']).index)]
+    newOnly = new[~new.set_index([KEY_FIELD, 'occurrence']).index.isin(old.set_index([KEY_FIELD, 'occurrence']).index)]
+    print(f'  {len(joined)} features matched by key, comparing {len(oldOnly)} removed and {len(newOnly)} added features geometrically')
+
+    # features with no partition are compared with each other, as a partition of their own
+    partitions = sorted(set(oldOnly[partitionBy].dropna()) | set(newOnly[partitionBy].dropna()))
+    if oldOnly[partitionBy].isnull().any() or newOnly[partitionBy].isnull().any():
+        partitions.append(None)
+
+    for partition in partitions:
+        inOld = oldOnly[partitionBy] == partition if partition is not None else oldOnly[partitionBy].isnull()
+        inNew = newOnly[partitionBy] == partition if partition is not None else newOnly[partitionBy].isnull()
+        removed = oldOnly[inOld].reset_index(drop=True)
+        added = newOnly[inNew].reset_index(drop=True)
+        matches, matched = matchGeometries(removed, added)
+
+        for i, j in enumerate(matches):
+            if j >= 0:
+                changed = [col for col in attributes if col != partitionBy and valuesDiffer([removed[col][i]], [added[col][j]])[0]]
+                changes.append((partition, 'geometry', removed[KEY_FIELD][i], added[KEY_FIELD][j], ','.join(changed)))
+            else:
+                changes.append((partition, 'removed', removed[KEY_FIELD][i], None, ''))
+
+        for j in np.flatnonzero(~matched):
+            changes.append((partition, 'added', None, added[KEY_FIELD][j], ''))
+
+    return pd.DataFrame(changes, columns=['partition', 'change', 'oldKey', 'newKey', 'columns'])
+
+def summarizeChanges (changes):
+    "Count changes of each type per partition, with features that have no partition counted under '(none)'"
+    changes = changes.assign(partition=changes.partition.where(changes.partition.notnull(), '(none)'))
+    return changes.groupby(['partition', 'change']).size().unstack(fill_value=0).reindex(columns=CHANGES, fill_value=0)
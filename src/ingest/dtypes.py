@@ -0,0 +1,75 @@
+# Compact in-memory representations of ingested data frames
+
+# Copyright 2018 Zoning.Space contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import numpy as np
+import pandas as pd
+
+# Relative error we are willing to accept when downcasting to float32. Zoning values are entered with at most a few
+# significant figures (e.g. 40 feet), so anything that survives the round trip at this tolerance loses nothing.
+FLOAT32_RTOL = 1e-6
+
+# Maximum ratio of unique values to rows for a string column to be stored as a categorical
+MAX_CATEGORICAL_RATIO = 0.5
+
+def memoryUsage (df):
+    "Approximate memory usage of a data frame in bytes, not counting geometries"
+    return df.drop(df.geometry.name, axis=1).memory_usage(deep=True).sum() if hasattr(df, 'geometry') else\
+        df.memory_usage(deep=True).sum()
+
+def dropUnusedColumns (df, keep):
+    "Drop all columns that are not in keep (the geometry column is always kept)"
+    keep = set(keep)
+    if hasattr(df, 'geometry'):
+        keep.add(df.geometry.name)
+    drop = [col for col in df.columns if col not in keep]
+    if len(drop) > 0:
+        print(f'      Dropping {len(drop)} unused columns: {", ".join(str(col) for col in drop)}')
+        df = df.drop(drop, axis=1)
+    return df
+
+def canDowncast (values):
+    "Can these float64 values be represented as float32 without meaningful loss of precision?"
+    downcast = values.astype(np.float32).astype(np.float64)
+    # infinities are meaningful (no limit) and survive the round trip
+    finite = np.isfinite(values)
+    return np.array_equal(np.isnan(downcast), np.isnan(values)) and\
+        np.array_equal(np.isinf(downcast), np.isinf(values)) and\
+        np.allclose(downcast[finite], values[finite], rtol=FLOAT32_RTOL, atol=0)
+
+def compactFrame (df, schema, categories={}):
+    """
+    Convert the columns of df that appear in the fiona schema to compact dtypes: floats to float32 where this loses
+    no precision, and strings to categoricals. categories maps column names to a list of all allowed values, so that
+    hooks can still assign those values to the categorical columns.
+    """
+    df = df.copy()
+    for col, typ in schema['properties'].items():
+        if col not in df.columns:
+            continue
+
+        if typ == 'float':
+            values = df[col].values.astype(np.float64)
+            if canDowncast(values):
+                df[col] = values.astype(np.float32)
+
+        elif typ == 'str':
+            if col in categories:
+                df[col] = pd.Categorical(df[col], categories=categories[col])
+            elif len(df) > 0 and df[col].nunique() / len(df) <= MAX_CATEGORICAL_RATIO:
+                df[col] = df[col].astype('category')
+
+    return df
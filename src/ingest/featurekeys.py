@@ -0,0 +1,91 @@
+# Stable keys for output features, so that builds can be compared with hash joins rather than spatial joins.
+# A key is a hash of the values of some key columns (e.g. jurisdiction and zone) and a hash of the geometry. The
+# geometry is normalized first (coordinates rounded, rings oriented and rotated to a canonical starting point, parts
+# sorted), so that the same shape produces the same key regardless of how it was constructed.
+
+# Copyright 2018 Zoning.Space contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import hashlib
+import numpy as np
+import pandas as pd
+import shapely.wkb
+from shapely.geometry.polygon import orient
+
+# Decimal places to round coordinates to before hashing; in WGS 84 this is about a centimeter
+KEY_PRECISION = 7
+
+# Length of keys, in hex digits
+KEY_LENGTH = 24
+
+def normalizeRing (coords, precision):
+    "Round a ring's coordinates and rotate it to start at its lowest vertex, returning an array without the closing vertex"
+    coords = np.round(np.asarray(coords)[:-1, :2], precision) + 0.0 # adding zero turns -0.0 into 0.0
+    if len(coords) == 0:
+        return coords
+    # drop consecutive duplicates created by rounding
+    keep = np.any(coords != np.roll(coords, 1, axis=0), axis=1)
+    if np.any(keep):
+        coords = coords[keep]
+    start = np.lexsort((coords[:, 1], coords[:, 0]))[0]
+    return np.roll(coords, -start, axis=0)
+
+def isDegenerate (ring):
+    "Whether a normalized ring has fewer than 3 distinct vertices, e.g. a sliver that collapsed when it was rounded"
+    return len(ring) == 0 or len(np.unique(ring, axis=0)) < 3
+
+def ringBytes (ring):
+    "Serialize a normalized ring, with its number of vertices so that the concatenation of rings is unambiguous"
+    return np.int64(len(ring)).tobytes() + np.ascontiguousarray(ring, dtype='<f8').tobytes()
+
+def normalizePolygon (polygon, precision):
+    "Serialize a polygon's normalized exterior and (sorted, non-degenerate) holes"
+    polygon = orient(polygon) # exterior counterclockwise, holes clockwise
+    exterior = normalizeRing(polygon.exterior.coords, precision)
+    # holes that collapse when rounded no longer describe any area
+    holes = [normalizeRing(ring.coords, precision) for ring in polygon.interiors]
+    holes = sorted(ringBytes(hole) for hole in holes if not isDegenerate(hole))
+    return ringBytes(exterior) + np.int64(len(holes)).tobytes() + b''.join(holes)
+
+def normalizeGeometry (geom, precision=KEY_PRECISION):
+    """
+    Serialize a polygonal geometry so that equivalent geometries give identical bytes. The rounded coordinates are
+    serialized directly rather than rebuilt into a geometry, since rounding can collapse a valid sliver into a ring that
+    Shapely won't construct.
+    """
+    if geom.type == 'Polygon':
+        parts = [geom]
+    elif geom.type == 'MultiPolygon':
+        parts = list(geom.geoms)
+    else:
+        return shapely.wkb.dumps(geom) # only polygons are normalized
+
+    parts = sorted(normalizePolygon(p, precision) for p in parts if not p.is_empty)
+    return np.int64(len(parts)).tobytes() + b''.join(parts)
+
+def geometryHash (geom, precision=KEY_PRECISION):
+    "Hash of the normalized geometry"
+    if geom is None or geom.is_empty:
+        return ''
+    return hashlib.sha1(normalizeGeometry(geom, precision)).hexdigest()
+
+def featureKeys (data, keyColumns, precision=KEY_PRECISION):
+    "Stable keys for each feature in a GeoDataFrame, based on the values of keyColumns and the geometry"
+    geomHashes = [geometryHash(g, precision) for g in data.geometry.values]
+    values = zip(*[data[col].astype(object).where(~pd.isnull(data[col]), '').values for col in keyColumns])
+    return np.array([
+        hashlib.sha1('\x1f'.join([str(v) for v in vals] + [h]).encode('utf-8')).hexdigest()[:KEY_LENGTH]
+        for vals, h in zip(values, geomHashes)
+    ], dtype=object)
@@ -0,0 +1,252 @@
+# Download source data into data/zoning from a directory, an HTTP(S) server, or an S3 bucket (or an S3-compatible
+# stand-in, e.g. MinIO). The source has a SHA256SUMS manifest, in the format written by sha256sum, and every file is
+# verified against it. Files are downloaded concurrently, to a .part file that is resumed with a range request if the
+# download is interrupted. Verified checksums are recorded in data/zoning/checksums.json, which the build cache uses
+# rather than hashing the files again (see cache.py).
+
+# Copyright 2018 Zoning.Space contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import shutil
+import hashlib
+from os.path import join, exists, getsize
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import Request, urlopen
+from urllib.error import HTTPError
+from urllib.parse import urlparse, unquote
+
+MANIFEST = 'SHA256SUMS'
+
+# File in the destination directory recording the checksums of verified files, with their sizes and modification times
+CHECKSUMS = 'checksums.json'
+
+# Number of files downloaded at once
+MAX_WORKERS = 4
+
+CHUNK_SIZE = 1024 * 1024
+
+def sha256 (filename):
+    "SHA-256 of the contents of a file"
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as raw:
+        for chunk in iter(lambda: raw.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def parseManifest (text):
+    "Parse a manifest written by sha256sum into a dict from file names to checksums"
+    checksums = {}
+    for line in text.splitlines():
+        if line.strip() == '':
+            continue
+        digest, name = line.strip().split(None, 1)
+        checksums[name.lstrip('*')] = digest.lower() # * marks binary mode
+    return checksums
+
+def writeManifest (directory, names=None):
+    "Write a SHA256SUMS manifest for the given files (default all files) in directory, e.g. before uploading them"
+    if names is None:
+        names = sorted(n for n in os.listdir(directory) if n not in (MANIFEST, CHECKSUMS) and os.path.isfile(join(directory, n)))
+    with open(join(directory, MANIFEST), 'w') as out:
+        for name in names:
+            out.write(f'{sha256(join(directory, name))}  {name}\n')
+    return names
+
+class DirectorySource (object):
+    "A local directory (or file:// URL), e.g. a mounted copy of the bucket"
+    def __init__ (self, directory):
+        self.directory = directory
+
+    def read (self, name):
+        with open(join(self.directory, name), 'rb') as raw:
+            return raw.read()
+
+    def copy (self, name, out, offset):
+        with open(join(self.directory, name), 'rb') as raw:
+            raw.seek(offset)
+            shutil.copyfileobj(raw, out, CHUNK_SIZE)
+        return offset
+
+class HttpSource (object):
+    "An HTTP(S) server, with files at base URL + name"
+    def __init__ (self, url):
+        self.url = url if url.endswith('/') else url + '/'
+
+    def read (self, name):
+        with urlopen(self.url + name) as response:
+            return response.read()
+
+    def copy (self, name, out, offset):
+        request = Request(self.url + name)
+        if offset > 0:
+            request.add_header('Range', f'bytes={offset}-')
+        try:
+            response = urlopen(request)
+        except HTTPError as e:
+            if e.code == 416:
+                # range not satisfiable: there is nothing after offset, so the partial download may be complete
+                return offset
+            raise
+        with response:
+            # a server that doesn't support ranges sends the whole file
+            start = offset if response.status == 206 else 0
+            out.seek(start)
+            out.truncate()
+            shutil.copyfileobj(response, out, CHUNK_SIZE)
+        return start
+
+class S3Source (object):
+    "An S3 bucket and prefix, s3://bucket/prefix. endpointUrl points to an S3-compatible server instead of AWS."
+    def __init__ (self, url, endpointUrl=None, requesterPays=False):
+        try:
+            import boto3
+        except ImportError:
+            raise RuntimeError('Fetching from S3 requires boto3 (pip install boto3)')
+        parsed = urlparse(url)
+        self.bucket = parsed.netloc
+        self.prefix = parsed.path.strip('/')
+        self.client = boto3.client('s3', endpoint_url=endpointUrl)
+        self.extra = {'RequestPayer': 'requester'} if requesterPays else {}
+
+    def key (self, name):
+        return f'{self.prefix}/{name}' if self.prefix != '' else name
+
+    def read (self, name):
+        return self.client.get_object(Bucket=self.bucket, Key=self.key(name), **self.extra)['Body'].read()
+
+    def copy (self, name, out, offset):
+        kwargs = dict(self.extra, Range=f'bytes={offset}-') if offset > 0 else self.extra
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self.key(name), **kwargs)
+        except self.client.exceptions.ClientError as e:
+            if e.response.get('Error', {}).get('Code') == 'InvalidRange':
+                # there is nothing after offset, so the partial download may be complete
+                return offset
+            raise
+        start = offset if 'ContentRange' in response else 0
+        out.seek(start)
+        out.truncate()
+        for chunk in iter(lambda: response['Body'].read(CHUNK_SIZE), b''):
+            out.write(chunk)
+        return start
+
+def openSource (source, endpointUrl=None, requesterPays=False):
+    "A source for a directory, file://, http(s):// or s3:// URL"
+    scheme = urlparse(source).scheme
+    if scheme == 's3':
+        return S3Source(source, endpointUrl=endpointUrl, requesterPays=requesterPays)
+    elif scheme in ('http', 'https'):
+        return HttpSource(source)
+    elif scheme == 'file':
+        return DirectorySource(unquote(urlparse(source).path))
+    else:
+        return DirectorySource(source)
+
+class Checksums (object):
+    "The checksums of verified files in a directory, keyed on name and valid as long as the file's size and modification time are unchanged"
+    def __init__ (self, directory):
+        self.filename = join(directory, CHECKSUMS)
+        self.lock = Lock()
+        self.entries = {}
+        if exists(self.filename):
+            with open(self.filename) as raw:
+                self.entries = json.load(raw)
+
+    def get (self, path):
+        "Recorded checksum of a file, or None if it has not been verified or has changed since"
+        entry = self.entries.get(os.path.basename(path))
+        if entry is None or not exists(path):
+            return None
+        stat = os.stat(path)
+        if entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime_ns:
+            return None
+        return entry['sha256']
+
+    def record (self, path, digest):
+        stat = os.stat(path)
+        with self.lock:
+            self.entries[os.path.basename(path)] = {'sha256': digest, 'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+    def save (self):
+        with self.lock:
+            tmp = self.filename + '.tmp'
+            with open(tmp, 'w') as out:
+                json.dump(self.entries, out, indent=2, sort_keys=True)
+            os.replace(tmp, self.filename)
+
+def fetchFile (source, name, expected, dest, checksums):
+    """
+    Download a file unless a verified copy is already present, resuming a partial download if there is one. Returns
+    'present' or 'downloaded'; raises ValueError if the download does not match the expected checksum.
+    """
+    path = join(dest, name)
+    if exists(path):
+        digest = checksums.get(path) or sha256(path)
+        if digest == expected:
+            checksums.record(path, digest)
+            return 'present'
+
+    part = path + '.part'
+    offset = getsize(part) if exists(part) else 0
+    if offset > 0:
+        # a run killed after the download finished but before the rename leaves a complete .part file, which can't be
+        # resumed (the server rejects a range starting at its end)
+        digest = sha256(part)
+        if digest == expected:
+            os.replace(part, path)
+            checksums.record(path, digest)
+            return 'downloaded'
+    with open(part, 'ab' if offset > 0 else 'wb') as out:
+        start = source.copy(name, out, offset)
+    if start > 0:
+        print(f'  {name}: resumed at {start} bytes')
+
+    digest = sha256(part)
+    if digest != expected:
+        # a corrupt partial download would otherwise be resumed forever
+        os.remove(part)
+        if start > 0:
+            print(f'  {name}: resumed download is corrupt, starting over')
+            return fetchFile(source, name, expected, dest, checksums)
+        raise ValueError(f'{name} has checksum {digest}, expected {expected}')
+    os.replace(part, path)
+    checksums.record(path, digest)
+    return 'downloaded'
+
+def fetch (source, names, dest, workers=MAX_WORKERS, manifest=None):
+    """
+    Download the named files from source (see openSource) to dest concurrently, verifying them against the source's
+    manifest (read from the source if not given). Returns a dict from names to 'present', 'downloaded', or the error
+    for files that failed.
+    """
+    if manifest is None:
+        manifest = parseManifest(source.read(MANIFEST).decode('utf-8'))
+    os.makedirs(dest, exist_ok=True)
+    checksums = Checksums(dest)
+
+    results = {name: f'not in {MANIFEST}' for name in names if name not in manifest}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {name: pool.submit(fetchFile, source, name, manifest[name], dest, checksums) for name in names if name in manifest}
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                results[name] = f'failed: {e}'
+            print(f'  {name}: {results[name]}')
+
+    checksums.save()
+    return results
@@ -0,0 +1,263 @@
+# A Collater that writes GeoPackages directly with SQLite, which is much faster than writing them record-by-record
+# through fiona. Each call to collate() is written in a single transaction, and the R-tree spatial index is built
+# once when the file is closed.
+
+# Copyright 2018 Zoning.Space contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import sqlite3
+import struct
+import os
+from os.path import basename, splitext, exists
+from datetime import datetime
+import numpy as np
+import shapely.wkb
+
+from .collater import Collater, INFINITY
+
+SRS_ID = 4326
+
+WGS84_WKT = 'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563,AUTHORITY["EPSG","7030"]],' +\
+    'AUTHORITY["EPSG","6326"]],PRIMEM["Greenwich",0,AUTHORITY["EPSG","8901"]],UNIT["degree",0.0174532925199433,' +\
+    'AUTHORITY["EPSG","9122"]],AUTHORITY["EPSG","4326"]]'
+
+# SQLite types for fiona schema types
+COLUMN_TYPES = {
+    'str': 'TEXT',
+    'float': 'REAL',
+    'int': 'INTEGER'
+}
+
+# Tables required by the GeoPackage spec, http://www.geopackage.org/spec120/
+METADATA_TABLES = '''
+CREATE TABLE gpkg_spatial_ref_sys (
+    srs_name TEXT NOT NULL,
+    srs_id INTEGER NOT NULL PRIMARY KEY,
+    organization TEXT NOT NULL,
+    organization_coordsys_id INTEGER NOT NULL,
+    definition TEXT NOT NULL,
+    description TEXT
+);
+CREATE TABLE gpkg_contents (
+    table_name TEXT NOT NULL PRIMARY KEY,
+    data_type TEXT NOT NULL,
+    identifier TEXT UNIQUE,
+    description TEXT DEFAULT '',
+    last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')),
+    min_x DOUBLE,
+    min_y DOUBLE,
+    max_x DOUBLE,
+    max_y DOUBLE,
+    srs_id INTEGER,
+    CONSTRAINT fk_gc_r_srs_id FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys(srs_id)
+);
+CREATE TABLE gpkg_geometry_columns (
+    table_name TEXT NOT NULL,
+    column_name TEXT NOT NULL,
+    geometry_type_name TEXT NOT NULL,
+    srs_id INTEGER NOT NULL,
+    z TINYINT NOT NULL,
+    m TINYINT NOT NULL,
+    CONSTRAINT pk_geom_cols PRIMARY KEY (table_name, column_name),
+    CONSTRAINT fk_gc_tn FOREIGN KEY (table_name) REFERENCES gpkg_contents(table_name),
+    CONSTRAINT fk_gc_srs FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys (srs_id)
+);
+CREATE TABLE gpkg_extensions (
+    table_name TEXT,
+    column_name TEXT,
+    extension_name TEXT NOT NULL,
+    definition TEXT NOT NULL,
+    scope TEXT NOT NULL,
+    CONSTRAINT ge_tce UNIQUE (table_name, column_name, extension_name)
+);
+'''
+
+# Triggers that keep the R-tree up to date if the file is edited later, from the GeoPackage spec. They use functions
+# provided by GDAL/SpatiaLite, so they are created after we have written all the features.
+RTREE_TRIGGERS = '''
+CREATE TRIGGER "rtree_{t}_{c}_insert" AFTER INSERT ON "{t}"
+WHEN (new."{c}" NOT NULL AND NOT ST_IsEmpty(NEW."{c}"))
+BEGIN
+  INSERT OR REPLACE INTO "rtree_{t}_{c}" VALUES (
+    NEW."{i}", ST_MinX(NEW."{c}"), ST_MaxX(NEW."{c}"), ST_MinY(NEW."{c}"), ST_MaxY(NEW."{c}")
+  );
+END;
+CREATE TRIGGER "rtree_{t}_{c}_update1" AFTER UPDATE OF "{c}" ON "{t}"
+WHEN OLD."{i}" = NEW."{i}" AND (NEW."{c}" NOTNULL AND NOT ST_IsEmpty(NEW."{c}"))
+BEGIN
+  INSERT OR REPLACE INTO "rtree_{t}_{c}" VALUES (
+    NEW."{i}", ST_MinX(NEW."{c}"), ST_MaxX(NEW."{c}"), ST_MinY(NEW."{c}"), ST_MaxY(NEW."{c}")
+  );
+END;
+CREATE TRIGGER "rtree_{t}_{c}_update2" AFTER UPDATE OF "{c}" ON "{t}"
+WHEN OLD."{i}" = NEW."{i}" AND (NEW."{c}" ISNULL OR ST_IsEmpty(NEW."{c}"))
+BEGIN
+  DELETE FROM "rtree_{t}_{c}" WHERE id = OLD."{i}";
+END;
+CREATE TRIGGER "rtree_{t}_{c}_update3" AFTER UPDATE ON "{t}"
+WHEN OLD."{i}" != NEW."{i}" AND (NEW."{c}" NOTNULL AND NOT ST_IsEmpty(NEW."{c}"))
+BEGIN
+  DELETE FROM "rtree_{t}_{c}" WHERE id = OLD."{i}";
+  INSERT OR REPLACE INTO "rtree_{t}_{c}" VALUES (
+    NEW."{i}", ST_MinX(NEW."{c}"), ST_MaxX(NEW."{c}"), ST_MinY(NEW."{c}"), ST_MaxY(NEW."{c}")
+  );
+END;
+CREATE TRIGGER "rtree_{t}_{c}_update4" AFTER UPDATE ON "{t}"
+WHEN OLD."{i}" != NEW."{i}" AND (NEW."{c}" ISNULL OR ST_IsEmpty(NEW."{c}"))
+BEGIN
+  DELETE FROM "rtree_{t}_{c}" WHERE id IN (OLD."{i}", NEW."{i}");
+END;
+CREATE TRIGGER "rtree_{t}_{c}_delete" AFTER DELETE ON "{t}"
+WHEN old."{c}" NOT NULL
+BEGIN
+  DELETE FROM "rtree_{t}_{c}" WHERE id = OLD."{i}";
+END;
+'''
+
+def geometryBlob (geom, bounds):
+    "Encode a geometry as a GeoPackage geometry blob: a header with the SRS and envelope, followed by WKB"
+    if geom is None:
+        return None
+    elif geom.is_empty:
+        # flags: little endian, no envelope, empty
+        return struct.pack('<2sBBi', b'GP', 0, 0x11, SRS_ID) + shapely.wkb.dumps(geom)
+    else:
+        minx, miny, maxx, maxy = bounds
+        # flags: little endian, xy envelope
+        return struct.pack('<2sBBi4d', b'GP', 0, 0x03, SRS_ID, minx, maxx, miny, maxy) + shapely.wkb.dumps(geom)
+
+class GeoPackageCollater (Collater):
+    usesRecords = False
+
+    def __init__ (self, schema, outfile, sort=False, keyColumns=None, layer=None, precision=None):
+        super().__init__(schema, outfile, driver='GPKG', sort=sort, keyColumns=keyColumns, precision=precision)
+        # fiona names the layer after the file by default
+        self.layer = layer if layer is not None else splitext(basename(outfile))[0]
+        self.geometryColumn = 'geom'
+        self.fidColumn = 'fid'
+        self.connection = None
+
+    def open (self):
+        if exists(self.outfilename):
+            os.remove(self.outfilename)
+
+        # we manage transactions ourselves
+        self.connection = sqlite3.connect(self.outfilename, isolation_level=None)
+        self.connection.execute('PRAGMA application_id = 1196444487') # GPKG
+        self.connection.execute('PRAGMA user_version = 10200') # version 1.2
+        # We are building the file from scratch, if we crash it is useless anyhow
+        self.connection.execute('PRAGMA synchronous = OFF')
+        self.connection.execute('PRAGMA journal_mode = MEMORY')
+
+        columns = ''.join(f', "{col}" {COLUMN_TYPES[typ]}' for col, typ in self.schema['properties'].items())
+
+        # executescript commits any open transaction, so create the metadata tables before beginning one
+        self.connection.executescript(METADATA_TABLES)
+        self.connection.execute('BEGIN')
+        self.connection.executemany('INSERT INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)', [
+            ('Undefined cartesian SRS', -1, 'NONE', -1, 'undefined', 'undefined cartesian coordinate reference system'),
+            ('Undefined geographic SRS', 0, 'NONE', 0, 'undefined', 'undefined geographic coordinate reference system'),
+            ('WGS 84 geodetic', SRS_ID, 'EPSG', SRS_ID, WGS84_WKT, 'longitude/latitude coordinates in decimal degrees on the WGS 84 spheroid')
+        ])
+        self.connection.execute(f'CREATE TABLE "{self.layer}" ("{self.fidColumn}" INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, ' +
+            f'"{self.geometryColumn}" {self.schema["geometry"].upper()}{columns})')
+        self.connection.execute('INSERT INTO gpkg_contents (table_name, data_type, identifier, srs_id) VALUES (?, ?, ?, ?)',
+            (self.layer, 'features', self.layer, SRS_ID))
+        self.connection.execute('INSERT INTO gpkg_geometry_columns VALUES (?, ?, ?, ?, 0, 0)',
+            (self.layer, self.geometryColumn, self.schema['geometry'].upper(), SRS_ID))
+        self.connection.execute('COMMIT')
+
+        self.nextFid = 1
+        self.bounds = [] # (fid, minx, maxx, miny, maxy), for building the spatial index at the end
+
+    def __exit__ (self, exception_type, exception_value, traceback):
+        # a half-written package is not indexed, so that an error there can't hide the original exception
+        self.close(buildIndex=exception_type is None)
+
+    def close (self, buildIndex=True):
+        if self.connection is not None:
+            try:
+                if buildIndex:
+                    self.buildSpatialIndex()
+            finally:
+                self.connection.close()
+                self.connection = None
+
+    def transaction (self, statements):
+        "Run statements (a function of the connection) in a transaction, rolling it back if they fail"
+        self.connection.execute('BEGIN')
+        try:
+            statements(self.connection)
+            self.connection.execute('COMMIT')
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            raise
+
+    def columnValues (self, values, typ):
+        "Convert a column to a list of values for SQLite, with NaNs as nulls and infinities as INFINITY"
+        if typ == 'float':
+            values = np.asarray(values, dtype=np.float64)
+            out = np.where(np.isinf(values), INFINITY, values).astype(object)
+            out[np.isnan(values)] = None
+            return out.tolist()
+        else:
+            out = np.asarray(values, dtype=object)
+            out[[v is None or (isinstance(v, float) and np.isnan(v)) for v in out]] = None
+            if typ == 'int':
+                return [int(v) if v is not None else None for v in out]
+            else:
+                return out.tolist()
+
+    def collate (self, data):
+        if self.connection is None:
+            raise Exception('Collater has not been opened (call open() or use a with statement).')
+
+        self.write(self.prepare(data))
+
+    def write (self, projected, records=None):
+        "Write prepared data; Fiona records are not used, since values are inserted directly"
+        geoms = projected.geometry.values
+        bounds = [g.bounds if g is not None and not g.is_empty else None for g in geoms]
+        fids = range(self.nextFid, self.nextFid + len(projected))
+        blobs = [geometryBlob(g, b) for g, b in zip(geoms, bounds)]
+        columns = [self.columnValues(projected[col].values, typ) for col, typ in self.schema['properties'].items()]
+
+        names = ', '.join(f'"{col}"' for col in [self.fidColumn, self.geometryColumn] + list(self.schema['properties'].keys()))
+        placeholders = ', '.join('?' for i in range(len(self.schema['properties']) + 2))
+
+        self.transaction(lambda db: db.executemany(f'INSERT INTO "{self.layer}" ({names}) VALUES ({placeholders})', zip(fids, blobs, *columns)))
+
+        self.bounds.extend((fid, b[0], b[2], b[1], b[3]) for fid, b in zip(fids, bounds) if b is not None)
+        self.nextFid += len(projected)
+
+    def buildSpatialIndex (self):
+        "Build the R-tree index in one pass, and record the extent of the layer"
+        rtree = f'rtree_{self.layer}_{self.geometryColumn}'
+
+        def index (db):
+            db.execute(f'CREATE VIRTUAL TABLE "{rtree}" USING rtree(id, minx, maxx, miny, maxy)')
+            db.executemany(f'INSERT INTO "{rtree}" VALUES (?, ?, ?, ?, ?)', self.bounds)
+            db.execute('INSERT INTO gpkg_extensions VALUES (?, ?, ?, ?, ?)',
+                (self.layer, self.geometryColumn, 'gpkg_rtree_index', 'http://www.geopackage.org/spec120/#extension_rtree', 'write-only'))
+
+            if len(self.bounds) > 0:
+                bounds = np.array(self.bounds)
+                db.execute('UPDATE gpkg_contents SET min_x = ?, max_x = ?, min_y = ?, max_y = ?, last_change = ? WHERE table_name = ?',
+                    (np.min(bounds[:,1]), np.max(bounds[:,2]), np.min(bounds[:,3]), np.max(bounds[:,4]),
+                        datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z', self.layer))
+
+        self.transaction(index)
+
+        self.connection.executescript(RTREE_TRIGGERS.format(t=self.layer, c=self.geometryColumn, i=self.fidColumn))
@@ -21,22 +21,98 @@
 
 
 from functools import partial
-import geopandas as gp
 import numpy as np
 from os.path import dirname, join
-from .shputils import readZippedShapefile
-from src.zoning.hooks import runHook
+from .shputils import pointsInWindow, WGS84
+from .validity import validShapefile, REPAIRED_COLUMN
+from .merge import mergeFragments
+from .dtypes import compactFrame, dropUnusedColumns, memoryUsage
+from src.zoning.hooks import runHook, hasHook, getHookAttribute, loadAuxiliary
 
 class Ingester(object):
-    def __init__ (self, collater):
+    # Allowed values of enumerated string columns, used to create categoricals when compacting
+    categories = {}
+
+    def __init__ (self, collater, compact=False, window=None, merge=False, chunk=None):
+        """
+        If compact is true, unused columns are dropped and the remainder stored using compact dtypes. If window
+        (minx, miny, maxx, maxy in WGS 84) is specified, only features overlapping it are read and processed, in full;
+        the window is then widened to cover them before auxiliary layers are loaded and hooks run. If merge is true,
+        adjacent features with identical schema attributes are merged after the hooks have run. If chunk (also a box in
+        WGS 84) is specified, only features with a representative point in it are processed, so that a slug can
+        be split between workers with each feature processed exactly once (see shardedBuild.py).
+        """
         self.collater = collater
+        self.compact = compact
+        self.window = window
+        self.chunk = chunk
+        self.merge = merge
+        self.mergeCounts = None # (features before, features after) merging
+        self.layers = None
         self.data = None
 
+    def sourceColumns (self):
+        "The columns of the source data that transform() needs"
+        return []
+
+    def hookColumns (self, slug, hooks):
+        "Source columns needed by the given hooks for slug, or None if they may need any column"
+        if not any(hasHook(slug, hook) for hook in hooks):
+            return []
+        else:
+            # hook files declare the source columns they use in a module-level list called columns
+            return getHookAttribute(slug, 'columns')
+
     def ingest (self, slug):
-        "Read a shapefile"
-        print('    Reading shapefile...')
-        shp = readZippedShapefile(join(dirname(__file__), '..', '..', 'data', 'zoning', slug + '.zip'))
-        shp = runHook(slug, 'before', shp)
+        "Read, process and collate a shapefile"
+        self.write(self.process(slug, self.read(slug)))
+
+    # ingest() is split into read, process and write stages, so that they can be overlapped (see pipeline.py)
+    def read (self, slug):
+        "Read a shapefile, and start loading the auxiliary layers used by its hooks in the background"
+        if self.chunk is None and self.window is None:
+            self.startAuxiliary(slug)
+
+        print(f'    Reading shapefile for {slug}...')
+        shp = validShapefile(join(dirname(__file__), '..', '..', 'data', 'zoning', slug + '.zip'),
+            bbox=self.chunk if self.chunk is not None else self.window)
+        if self.chunk is not None:
+            shp = shp[pointsInWindow(shp.geometry, self.chunk)]
+            print(f'      {len(shp)} features are in the chunk')
+            # features can extend beyond the chunk, so hooks and auxiliary layers need to cover all of them
+            self.window = tuple(shp.geometry.to_crs(WGS84).total_bounds) if len(shp) > 0 else self.chunk
+            self.startAuxiliary(slug)
+        elif self.window is not None:
+            print(f'      {len(shp)} features overlap the window')
+            # likewise, features crossing the edge of the window are processed in full
+            if len(shp) > 0:
+                fminx, fminy, fmaxx, fmaxy = shp.geometry.to_crs(WGS84).total_bounds
+                minx, miny, maxx, maxy = self.window
+                self.window = (float(min(minx, fminx)), float(min(miny, fminy)), float(max(maxx, fmaxx)), float(max(maxy, fmaxy)))
+            self.startAuxiliary(slug)
+
+        # invalid geometries were repaired in bulk when the shapefile was read, so hooks and overlays get clean input
+        repaired = shp[REPAIRED_COLUMN].values
+        shp = shp.drop(REPAIRED_COLUMN, axis=1)
+        if np.any(repaired):
+            lost = np.sum(repaired & shp.geometry.isnull().values)
+            print(f'      Repaired {np.sum(repaired)} invalid geometries for {slug}' + (f', {lost} of which had no area and will be dropped' if lost > 0 else ''))
+
+        if self.compact:
+            hookColumns = self.hookColumns(slug, ['before', 'after'])
+            if hookColumns is not None:
+                shp = dropUnusedColumns(shp, self.sourceColumns() + hookColumns)
+
+        return shp
+
+    def startAuxiliary (self, slug):
+        self.layers = loadAuxiliary(slug, self.window)
+        if self.layers is not None:
+            print(f'    Loading auxiliary layers {", ".join(self.layers.keys())} in the background...')
+
+    def process (self, slug, shp):
+        "Run hooks and transform the data read by read()"
+        shp = runHook(slug, 'before', shp, self.window, self.layers)
 
         # Drop features with no geometry (I know, what?)
         # https://github.com/geopandas/geopandas/issues/138
@@ -50,7 +126,28 @@ class Ingester(object):
         # Call subclass method to add standardized columns
         df = self.transform(shp)
 
-        df = runHook(slug, 'after', df)
+        if self.compact:
+            print('    Compacting columns...')
+            before = memoryUsage(df)
+            hookColumns = self.hookColumns(slug, ['after'])
+            if hookColumns is not None:
+                df = dropUnusedColumns(df, list(self.collater.schema['properties'].keys()) + hookColumns)
+            df = compactFrame(df, self.collater.schema, self.categories)
+            print(f'      Attribute memory reduced from {before / 1e6:.1f} MB to {memoryUsage(df) / 1e6:.1f} MB')
+
+        df = runHook(slug, 'after', df, self.window, self.layers)
+        self.layers = None # free memory
+
+        if self.merge:
+            print('    Merging adjacent fragments with identical attributes...')
+            before = len(df)
+            df = mergeFragments(df, [col for col in self.collater.schema['properties'].keys() if col in df.columns])
+            self.mergeCounts = (before, len(df))
+            print(f'      {slug}: merged {before} features into {len(df)} ({1 - len(df) / max(before, 1):.1%} fewer)')
+
+        return df
 
+    def write (self, df):
+        "Write processed data to the collater"
         print('    Writing to collater...')
         self.collater.collate(df)
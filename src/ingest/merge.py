@@ -0,0 +1,97 @@
+# Merge adjacent fragments with identical attributes. Overlays in hooks split each zoning polygon into many fragments,
+# and adjacent fragments often end up with the same values for every output attribute, so they can be written as one
+# feature. Candidate neighbors are found with a spatial index, so each union only involves a few nearby fragments.
+
+# Copyright 2018 Zoning.Space contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pandas as pd
+import geopandas as gp
+import shapely
+import shapely.ops
+
+def attributeGroups (df, columns):
+    "Integer group for each row of df, such that rows in the same group have identical values (including missing values) in columns"
+    codes = np.column_stack([pd.factorize(df[col].values)[0] for col in columns]) if len(columns) > 0 else\
+        np.zeros((len(df), 1), dtype=np.int64)
+    return np.unique(codes, axis=0, return_inverse=True)[1].reshape(-1)
+
+def candidatePairs (geoms):
+    "Pairs of positions (i < j) of geometries whose bounding boxes intersect, using a spatial index"
+    sindex = gp.GeoSeries(geoms).sindex
+    if hasattr(sindex, 'query') and hasattr(shapely, 'relate'):
+        left, right = sindex.query(np.asarray(geoms, dtype=object))
+    else:
+        pairs = [(i, j) for i, geom in enumerate(geoms) if geom is not None for j in sindex.intersection(geom.bounds)]
+        left = np.array([p[0] for p in pairs], dtype=np.int64)
+        right = np.array([p[1] for p in pairs], dtype=np.int64)
+    keep = left < right
+    return left[keep], right[keep]
+
+def adjacent (a, b):
+    "Whether each pair of geometries shares part of an edge or overlaps (touching at a corner does not count)"
+    if hasattr(shapely, 'relate'):
+        matrices = shapely.relate(a, b)
+    else:
+        matrices = [x.relate(y) for x, y in zip(a, b)]
+    # DE-9IM: interiors intersect in an area, or boundaries intersect in a line
+    return np.array([m[0] == '2' or m[4] == '1' for m in matrices], dtype=bool)
+
+def connectedComponents (n, left, right):
+    "Label the connected components of a graph with n nodes and edges between left and right (union-find)"
+    parent = np.arange(n)
+
+    def find (i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]] # path halving
+            i = parent[i]
+        return i
+
+    for i, j in zip(left, right):
+        ri, rj = find(i), find(j)
+        if ri != rj:
+            parent[max(ri, rj)] = min(ri, rj)
+
+    return np.array([find(i) for i in range(n)])
+
+def mergeFragments (df, columns):
+    """
+    Merge adjacent features of the GeoDataFrame df that have identical values in all of columns. Each merged feature
+    keeps the other attributes of the first fragment it contains. Returns the merged frame, in the original order.
+    """
+    df = df[df.geometry.notnull()].reset_index(drop=True)
+    if len(df) < 2:
+        return df
+
+    groups = attributeGroups(df, columns)
+    geoms = np.asarray(df.geometry.values, dtype=object)
+    left, right = candidatePairs(geoms)
+    same = groups[left] == groups[right]
+    left, right = left[same], right[same]
+    touching = adjacent(geoms[left], geoms[right]) if len(left) > 0 else np.zeros(0, dtype=bool)
+
+    components = connectedComponents(len(df), left[touching], right[touching])
+    # since each component is labeled with its lowest position, the first fragment of each component is its label
+    first = np.flatnonzero(components == np.arange(len(df)))
+    if len(first) == len(df):
+        return df
+
+    merged = df.iloc[first].copy()
+    sizes = np.bincount(components, minlength=len(df))
+    members = pd.Series(np.arange(len(df))).groupby(components).apply(list)
+    mergedGeoms = [shapely.ops.unary_union(list(geoms[members[label]])) if sizes[label] > 1 else geoms[label]
+        for label in first]
+    merged[df.geometry.name] = gp.GeoSeries(mergedGeoms, index=merged.index, crs=df.crs)
+    return merged.reset_index(drop=True)
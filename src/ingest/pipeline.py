@@ -0,0 +1,99 @@
+# Pipelined ingestion: overlap reading, processing and writing of consecutive slugs
+
+# Copyright 2018 Zoning.Space contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from threading import Thread, Semaphore, Event
+from queue import Queue
+
+# Marks the end of a queue
+_DONE = object()
+
+class _Failure (object):
+    "Wraps an exception raised in a background thread, so it can be re-raised in the main thread"
+    def __init__ (self, exception):
+        self.exception = exception
+
+def ingestPipelined (jobs):
+    """
+    Ingest a list of (slug, ingester) pairs, in order. While one slug is being processed (hooks and transform) in the
+    calling thread, a background thread reads the next slug, and another writes the previously processed slug to its
+    collater. At most one slug is read ahead of the one being processed, so memory usage stays bounded.
+    """
+    readQueue = Queue()
+    writeQueue = Queue(maxsize=1)
+    # released each time the main thread takes a slug off the read queue, so the reader is at most one slug ahead
+    readAhead = Semaphore(1)
+    stop = Event()
+    writeErrors = []
+
+    def reader ():
+        try:
+            for slug, ingester in jobs:
+                readAhead.acquire()
+                if stop.is_set():
+                    return
+                readQueue.put((slug, ingester, ingester.read(slug)))
+            readQueue.put(_DONE)
+        except BaseException as e:
+            readQueue.put(_Failure(e))
+
+    def writer ():
+        while True:
+            item = writeQueue.get()
+            if item is _DONE:
+                return
+            elif len(writeErrors) > 0:
+                continue # drain the queue so the main thread does not block
+
+            ingester, df = item
+            try:
+                ingester.write(df)
+            except BaseException as e:
+                writeErrors.append(e)
+
+    readThread = Thread(target=reader, name='zoning-reader', daemon=True)
+    writeThread = Thread(target=writer, name='zoning-writer', daemon=True)
+    readThread.start()
+    writeThread.start()
+
+    try:
+        while True:
+            item = readQueue.get()
+            readAhead.release()
+
+            if item is _DONE:
+                break
+            elif isinstance(item, _Failure):
+                raise item.exception
+
+            slug, ingester, shp = item
+            print(f'  Processing {slug}...')
+            df = ingester.process(slug, shp)
+            del shp, item # allow the raw data to be garbage collected while the next slug is read
+
+            if len(writeErrors) > 0:
+                raise writeErrors[0]
+
+            writeQueue.put((ingester, df))
+            del df
+    finally:
+        stop.set()
+        readAhead.release() # unblock the reader if we are exiting early
+        writeQueue.put(_DONE)
+        writeThread.join()
+
+    if len(writeErrors) > 0:
+        raise writeErrors[0]
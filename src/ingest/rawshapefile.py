@@ -0,0 +1,154 @@
+# Read attributes and areas directly from a zipped shapefile, without decoding geometries into Shapely objects.
+# This is much faster than readZippedShapefile when only a few attribute columns are needed.
+
+# Copyright 2018 Zoning.Space contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import struct
+import codecs
+from zipfile import ZipFile
+from os.path import splitext
+import numpy as np
+import pandas as pd
+
+# shape types with polygon geometries (Polygon, PolygonZ, PolygonM)
+POLYGON_TYPES = {5, 15, 25}
+
+def findMembers (zf, shpzip):
+    "Find the members of the shapefile in the zip file, returned as a dict from lowercase extension to member name"
+    shps = [name for name in zf.namelist() if name.lower().endswith('.shp')]
+    if len(shps) == 0:
+        raise ValueError(f'No shapefile found in {shpzip}!')
+    elif len(shps) > 1:
+        raise ValueError(f'Multiple shapefiles found in {shpzip}!')
+
+    stem = splitext(shps[0])[0]
+    return {
+        splitext(name)[1].lower(): name
+        for name in zf.namelist()
+        if splitext(name)[0] == stem
+    }
+
+def cpgEncoding (raw, default):
+    "Convert the contents of a .cpg file to a Python encoding name"
+    encoding = raw.decode('ascii', errors='ignore').strip()
+    if encoding.isdigit():
+        encoding = 'cp' + encoding # ANSI code pages are specified by number, e.g. 1252
+    try:
+        return codecs.lookup(encoding).name
+    except LookupError:
+        return default
+
+def parseDbf (raw, columns, encoding='utf-8'):
+    """
+    Parse the given columns from the raw bytes of a DBF file. Returns a DataFrame with the columns that were found,
+    and a boolean array of which records have been deleted.
+    """
+    nRecords, headerLength, recordLength = struct.unpack('<xxxxIHH', raw[:12])
+
+    fields = []
+    offset = 1 # first byte of each record is the deletion flag
+    for pos in range(32, headerLength - 1, 32):
+        if raw[pos] == 0x0D:
+            break # end of field descriptors
+        name = raw[pos:pos + 11].split(b'\x00')[0].decode('ascii')
+        fieldType = chr(raw[pos + 11])
+        length = raw[pos + 16]
+        decimals = raw[pos + 17]
+        fields.append((name, fieldType, offset, length, decimals))
+        offset += length
+
+    # read all records at once as fixed-width byte strings
+    dtype = np.dtype({
+        'names': ['deleted'] + [f[0] for f in fields],
+        'formats': ['S1'] + [f'S{f[3]}' for f in fields],
+        'offsets': [0] + [f[2] for f in fields],
+        'itemsize': recordLength
+    })
+    records = np.frombuffer(raw, dtype=dtype, count=nRecords, offset=headerLength)
+
+    out = pd.DataFrame(index=np.arange(nRecords))
+    for name, fieldType, offset, length, decimals in fields:
+        if name not in columns:
+            continue
+
+        values = [v.strip() for v in records[name]]
+        if fieldType in ('N', 'F'):
+            # convert numbers the way OGR does: integers if there are no decimals, floats otherwise
+            def parseNumber (v):
+                if v == b'' or v.startswith(b'*'):
+                    return None # null (asterisks indicate an overflowed value)
+                elif decimals == 0:
+                    return int(v)
+                else:
+                    return float(v)
+            out[name] = [parseNumber(v) for v in values]
+        else:
+            out[name] = [v.decode(encoding, errors='replace') if v != b'' else None for v in values]
+
+    deleted = records['deleted'] == b'*'
+    return out, deleted
+
+def shpAreas (raw):
+    """
+    Compute the planar area of every record in the raw bytes of a .shp file, in the units of its coordinate system.
+    Non-polygon and null records have area 0.
+    """
+    areas = []
+    pos = 100 # skip file header
+    while pos < len(raw):
+        # record header is big endian, content length is in 16-bit words
+        contentLength = struct.unpack('>I', raw[pos + 4:pos + 8])[0] * 2
+        content = pos + 8
+        shapeType = struct.unpack('<i', raw[content:content + 4])[0]
+
+        if shapeType in POLYGON_TYPES:
+            nParts, nPoints = struct.unpack('<ii', raw[content + 36:content + 44])
+            parts = np.frombuffer(raw, dtype='<i4', count=nParts, offset=content + 44)
+            points = np.frombuffer(raw, dtype='<f8', count=nPoints * 2, offset=content + 44 + 4 * nParts).reshape(-1, 2)
+
+            # shoelace formula over all rings at once, dropping the terms that would join one ring to the next
+            x = points[:, 0] - points[0, 0] # translate to improve numerical stability
+            y = points[:, 1] - points[0, 1]
+            cross = x[:-1] * y[1:] - x[1:] * y[:-1]
+            cross[parts[1:] - 1] = 0
+            # outer rings are clockwise and holes counterclockwise in shapefiles, so the signed area is negative
+            areas.append(abs(-np.sum(cross) / 2))
+        else:
+            areas.append(0)
+
+        pos = content + contentLength
+
+    return np.array(areas, dtype=np.float64)
+
+def readZippedShapefileAttributes (shpzip, columns, areas=False):
+    """
+    Read the given attribute columns from a zipped shapefile, without decoding the geometries. Columns that are not
+    present are omitted. If areas is true, a column 'area' is added with the area of each feature in the units of
+    the shapefile's coordinate system (this is only meaningful in relative terms for unprojected data).
+    """
+    with ZipFile(shpzip) as zf:
+        members = findMembers(zf, shpzip)
+
+        encoding = 'utf-8'
+        if '.cpg' in members:
+            encoding = cpgEncoding(zf.read(members['.cpg']), encoding)
+
+        attributes, deleted = parseDbf(zf.read(members['.dbf']), columns, encoding=encoding)
+
+        if areas:
+            attributes['area'] = shpAreas(zf.read(members['.shp']))
+
+    return attributes[~deleted].reset_index(drop=True)
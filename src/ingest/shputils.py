@@ -14,16 +14,128 @@
 
 
 from zipfile import ZipFile
+import os
+import math
+import numpy as np
+import fiona
+import pyproj
 import geopandas as gp
+import shapely
 import shapely.ops
+from shapely.geometry import Polygon
+from shapely.prepared import prep
 from tempfile import mkdtemp
 from shutil import rmtree
 from tqdm import trange
 
-def readZippedShapefile (shpzip):
+# Albers equal area projection for the continental US, for area calculations
+EQUAL_AREA_CRS = '+proj=aea +lat_1=29.5 +lat_2=45.5 +lat_0=37.5 +lon_0=-96 +x_0=0 +y_0=0 +datum=NAD83 +units=m +no_defs'
+
+WGS84 = {'init': 'epsg:4326'}
+
+# Meters per degree of latitude, used to convert distances to degrees when expanding windows
+METERS_PER_DEGREE = 111320
+
+# Opt-in fixed precision model. If set, geometries are snapped to a grid of this size (in meters) after they are read
+# and repaired (see validity.py) and before and after overlays, so that nearly coincident edges become exactly coincident rather than producing slivers.
+gridSize = None
+
+def crsUnit (crs):
+    "Size of a unit of crs in meters, approximating degrees at the equator; data with no CRS is assumed to be in meters"
+    if not crs:
+        return 1
+    if hasattr(pyproj, 'CRS'):
+        crs = pyproj.CRS.from_user_input(crs)
+        if crs.is_geographic:
+            return METERS_PER_DEGREE
+        return crs.axis_info[0].unit_conversion_factor
+    else:
+        # older pyproj, without CRS objects
+        proj = pyproj.Proj(**crs) if isinstance(crs, dict) else pyproj.Proj(crs)
+        if proj.is_latlong():
+            return METERS_PER_DEGREE
+        return 0.3048006096012192 if 'us-ft' in proj.srs else 0.3048 if '+units=ft' in proj.srs else 1
+
+def snapGeometries (geoms, grid):
+    "Snap geometries to a grid of the given size (in their own units), repairing any invalid geometries this creates"
+    if hasattr(shapely, 'set_precision'):
+        geoms = np.asarray(geoms, dtype=object)
+        # set_precision raises on invalid input, e.g. self-intersecting polygons that have not been repaired
+        invalid = ~shapely.is_valid(geoms) & ~shapely.is_missing(geoms)
+        if np.any(invalid):
+            geoms = geoms.copy()
+            geoms[invalid] = shapely.make_valid(geoms[invalid])
+        return list(shapely.set_precision(geoms, grid))
+
+    def snap (geom):
+        if geom is None or geom.is_empty:
+            return geom
+        snapped = shapely.ops.transform(lambda x, y, z=None: (np.round(np.asarray(x) / grid) * grid, np.round(np.asarray(y) / grid) * grid), geom)
+        return snapped if snapped.is_valid else snapped.buffer(0)
+
+    return [snap(g) for g in geoms]
+
+def snapFrame (df, size=None):
+    "Snap the geometries of a GeoDataFrame to a grid of size meters (default gridSize); returns df unchanged if neither is set"
+    size = size if size is not None else gridSize
+    if size is None:
+        return df
+    df = df.copy()
+    df[df.geometry.name] = gp.GeoSeries(snapGeometries(df.geometry.values, size / crsUnit(df.crs)), index=df.index, crs=df.crs)
+    return df
+
+def overlay (df1, df2, how='intersection'):
+    "GeoPandas overlay, snapping the inputs and result to the precision grid (see gridSize) if one is set"
+    return snapFrame(gp.overlay(snapFrame(df1), snapFrame(df2), how=how))
+
+def windowPolygon (window, pointsPerSide=16):
+    "A polygon for a (minx, miny, maxx, maxy) window, with extra points along each side so that it reprojects accurately"
+    minx, miny, maxx, maxy = window
+    t = np.linspace(0, 1, pointsPerSide, endpoint=False)
+    xs = np.concatenate([minx + t * (maxx - minx), np.full(pointsPerSide, maxx), maxx - t * (maxx - minx), np.full(pointsPerSide, minx)])
+    ys = np.concatenate([np.full(pointsPerSide, miny), miny + t * (maxy - miny), np.full(pointsPerSide, maxy), maxy - t * (maxy - miny)])
+    return Polygon(list(zip(xs, ys)))
+
+def windowBounds (window, crs):
+    "Bounds, in crs, of a window in WGS 84"
+    if not crs:
+        return tuple(window) # assume unprojected data is in WGS 84
+    return tuple(gp.GeoSeries([windowPolygon(window)], crs=WGS84).to_crs(crs).total_bounds)
+
+def bufferWindow (window, meters):
+    "Expand a window in WGS 84 by at least the given distance in meters, e.g. to include features that affect it from nearby"
+    if window is None:
+        return None
+    minx, miny, maxx, maxy = window
+    dy = meters / METERS_PER_DEGREE
+    # degrees of longitude are shortest at the edge furthest from the equator
+    dx = dy / math.cos(math.radians(min(max(abs(miny), abs(maxy)) + dy, 89)))
+    return (minx - dx, miny - dy, maxx + dx, maxy + dy)
+
+def pointsInWindow (geometry, window):
+    """
+    Boolean array of whether a representative point of each geometry in a GeoSeries is in a window in WGS 84. The
+    window includes its minimum edges but not its maximum edges, so each geometry is in exactly one of a grid of windows.
+    """
+    missing = geometry.isnull().values
+    points = gp.GeoSeries([g.representative_point() if g is not None and not g.is_empty else None for g in geometry.values],
+        crs=geometry.crs)
+    if geometry.crs:
+        points = points.to_crs(WGS84)
+    minx, miny, maxx, maxy = window
+    x = np.array([p.x if p is not None else np.nan for p in points.values])
+    y = np.array([p.y if p is not None else np.nan for p in points.values])
+    return ~missing & (x >= minx) & (x < maxx) & (y >= miny) & (y < maxy)
+
+def readZippedShapefile (shpzip, bbox=None):
+    """
+    Read a zipped shapefile. If bbox (minx, miny, maxx, maxy, in WGS 84) is specified, only features that overlap it
+    are read; features that cross its edges are read in full. Geometries are returned as read, neither repaired nor
+    snapped to the precision grid (see validShapefile).
+    """
     if type(shpzip) == str:
         with open(shpzip, 'rb') as raw:
-            return readZippedShapefile(raw)
+            return readZippedShapefile(raw, bbox)
     else:
         tmp = mkdtemp()
 
@@ -39,48 +151,108 @@ def readZippedShapefile (shpzip):
                 else:
                     shapePath = pth
 
-        shp = gp.read_file(shapePath)
+        if bbox is not None:
+            with fiona.open(shapePath) as layer:
+                crs = layer.crs
+            shp = gp.read_file(shapePath, bbox=windowBounds(bbox, crs))
+        else:
+            shp = gp.read_file(shapePath)
         rmtree(tmp)
         return shp
 
 
+def zippedShapefileBounds (shpzip):
+    "Bounds of a zipped shapefile in WGS 84, from its header, without reading its features"
+    tmp = mkdtemp()
+    try:
+        with ZipFile(shpzip) as zf:
+            zf.extractall(tmp)
+            shps = [name for name in zf.namelist() if name.lower().endswith('.shp')]
+        if len(shps) != 1:
+            raise ValueError(f'Expected one shapefile in {shpzip}, found {len(shps)}')
+        with fiona.open(os.path.join(tmp, shps[0])) as layer:
+            bounds, crs = layer.bounds, layer.crs
+    finally:
+        rmtree(tmp)
+    if not crs:
+        return tuple(bounds) # assume unprojected data is in WGS 84
+    return tuple(gp.GeoSeries([windowPolygon(bounds)], crs=crs).to_crs(WGS84).total_bounds)
+
 # GeoPandas overlay is way too slow to be usable for this, so roll our own that is several orders of magnitude faster
 # Note: this will not work if the features in one or the other dataframe are not disjoint
-def fastOverlay (df1, df2, minArea=100):
+def fastOverlay (df1, df2, minArea=100, snapTolerance=1e-2):
     outrows = []
+
+    # with a precision model, snap both inputs to the same grid so that shared edges coincide exactly
+    df1 = snapFrame(df1)
+    df2 = snapFrame(df2)
+
+    if len(df2) > 0:
+        sindex = df2.sindex
+        # The area of df1 covered by df2, computed once so that we can skip the expensive difference operation for
+        # polygons that are entirely inside or outside of it. Since df2 is disjoint the union is cheap.
+        coverage = prep(shapely.ops.unary_union(df2.geometry.values))
+
     for i in trange(len(df1)):
-        geom = df1.iloc[i].geometry
-        intersectingGeoms = df2.intersects(geom)
-        intersections = df2[intersectingGeoms].intersection(geom)
-        remainingGeom = geom.difference(shapely.ops.unary_union(intersections.values).buffer(1e-2))
-
-        for index, intersection in intersections[intersections.area > minArea].iteritems(): # drop slivers
-            if intersection.type == 'Polygon':
-                parts = [intersection]
-            elif intersection.type == 'MultiPolygon':
-                parts = intersection.geoms
-            elif intersection.type == 'GeometryCollection':
-                # get rid of point and line intersections when geometries just touch
-                parts = [part for part in intersection.geoms if part.type == 'Polygon']
-
-            for part in parts:
-                row = df1.iloc[i].copy()
+        base = df1.iloc[i]
+        geom = base.geometry
+
+        if len(df2) == 0 or not coverage.intersects(geom):
+            # entirely outside of df2
+            intersections = df2.geometry.iloc[:0]
+            remainingGeom = geom
+        else:
+            candidates = df2.iloc[list(sindex.intersection(geom.bounds))]
+            intersections = candidates[candidates.intersects(geom)].intersection(geom)
+
+            if coverage.contains(geom):
+                # entirely inside df2, nothing remains
+                remainingGeom = None
+            else:
+                # Snap the union of the intersections to the original geometry, so that near-coincident edges line
+                # up exactly rather than leaving slivers behind
+                union = shapely.ops.snap(shapely.ops.unary_union(intersections.values), geom, snapTolerance)
+                remainingGeom = geom.difference(union)
+
+            intersections = intersections[intersections.area > minArea] # drop slivers
+
+        for index, intersection in intersections.iteritems():
+            for part in polygonParts(intersection):
+                row = base.copy()
                 row = row.combine_first(df2.loc[index])
                 row['geometry'] = part
                 outrows.append(row)
 
-        if remainingGeom.type == 'Polygon':
-            remainingGeoms = [remainingGeom]
-        elif remainingGeom.type == 'MultiPolygon':
-            remainingGeoms = remainingGeom.geoms
-        elif remainingGeom.type == 'GeometryCollection':
-            remainingGeoms = [part for part in remainingGeom.geoms if part.type == 'Polygon']
-
-        for part in remainingGeoms:
+        for part in polygonParts(remainingGeom):
             if part.area > minArea:
-                row = df1.iloc[i].copy()
+                row = base.copy()
                 row['geometry'] = part
                 outrows.append(row)
 
-    # drop=True avoids issues with multiple overlays (https://stackoverflow.com/questions/12203901)
-    return gp.GeoDataFrame(outrows, geometry='geometry').reset_index(drop=True)
+    if len(outrows) == 0:
+        out = df1.iloc[:0].reset_index(drop=True)
+    else:
+        # drop=True avoids issues with multiple overlays (https://stackoverflow.com/questions/12203901)
+        out = gp.GeoDataFrame(outrows, geometry='geometry').reset_index(drop=True)
+        out.crs = df1.crs
+
+    # add the columns of df2 even if nothing overlapped it, which is common when reading only a small window
+    for col in df2.columns:
+        if col not in out.columns:
+            out[col] = np.nan
+
+    return snapFrame(out)
+
+def polygonParts (geom):
+    "Split a geometry into its constituent polygons, discarding points and lines"
+    if geom is None or geom.is_empty:
+        return []
+    elif geom.type == 'Polygon':
+        return [geom]
+    elif geom.type == 'MultiPolygon':
+        return list(geom.geoms)
+    elif geom.type == 'GeometryCollection':
+        # get rid of point and line intersections when geometries just touch
+        return [part for g in geom.geoms for part in polygonParts(g)]
+    else:
+        return []
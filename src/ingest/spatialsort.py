@@ -0,0 +1,65 @@
+# Order features along a Hilbert curve, so that features that are close together in space are close together in files
+
+# Copyright 2018 Zoning.Space contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import numpy as np
+import geopandas as gp
+
+from .shputils import EQUAL_AREA_CRS
+
+# Number of bits per dimension, so the curve covers a 65536 x 65536 grid
+HILBERT_ORDER = 16
+
+def hilbertIndex (x, y, order=HILBERT_ORDER):
+    "Position along a Hilbert curve of integer grid coordinates x and y (arrays in [0, 2 ** order)), vectorized"
+    x = np.array(x, dtype=np.int64)
+    y = np.array(y, dtype=np.int64)
+    d = np.zeros(len(x), dtype=np.int64)
+
+    s = 1 << (order - 1)
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        d += s * s * ((3 * rx) ^ ry)
+
+        # rotate the quadrant so the curve is continuous
+        flip = ~ry & rx
+        x = np.where(flip, s - 1 - x, x)
+        y = np.where(flip, s - 1 - y, y)
+        swap = ~ry
+        x, y = np.where(swap, y, x), np.where(swap, x, y)
+
+        s >>= 1
+
+    return d
+
+def hilbertKeys (geometry, order=HILBERT_ORDER):
+    "Hilbert curve position of the centroid of each geometry in a GeoSeries, in an equal-area projection"
+    if len(geometry) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    centroids = gp.GeoSeries(geometry.centroid, crs=geometry.crs).to_crs(EQUAL_AREA_CRS)
+    x = centroids.x.values
+    y = centroids.y.values
+
+    # scale to the grid, using the same scale in both dimensions so the curve does not distort space
+    extent = max(np.max(x) - np.min(x), np.max(y) - np.min(y), 1)
+    scale = ((1 << order) - 1) / extent
+    return hilbertIndex((x - np.min(x)) * scale, (y - np.min(y)) * scale, order=order)
+
+def hilbertSort (data):
+    "Sort a GeoDataFrame along a Hilbert curve of feature centroids"
+    return data.iloc[np.argsort(hilbertKeys(data.geometry), kind='mergesort')]
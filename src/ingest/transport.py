@@ -0,0 +1,212 @@
+# Hand data frames between processes without pickling geometries. A frame is packed into a directory of flat files
+# (in shared memory at /dev/shm where available): geometries as one contiguous WKB buffer plus offsets, numeric columns
+# as NumPy arrays, and string columns as one UTF-8 buffer plus offsets. The handle to the packed frame is tiny and cheap
+# to pickle, and the receiving process memory-maps the files and only decodes the columns and geometries it uses.
+
+# Copyright 2018 Zoning.Space contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import pickle
+import os
+from os.path import join, exists, isdir
+from tempfile import mkdtemp
+from shutil import rmtree
+import numpy as np
+import pandas as pd
+import geopandas as gp
+import shapely
+import shapely.wkb
+
+# Use shared memory if it is available, so packed frames never touch the disk
+SHARED_MEMORY_DIR = '/dev/shm' if isdir('/dev/shm') else None
+
+def packBuffers (values):
+    "Pack a sequence of bytes objects (or None) into one buffer, returning (buffer, offsets, null mask)"
+    isNull = np.array([v is None for v in values], dtype=bool)
+    lengths = np.array([len(v) if v is not None else 0 for v in values], dtype=np.int64)
+    offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return b''.join(v for v in values if v is not None), offsets, isNull
+
+def unpackBuffers (buffer, offsets, isNull, decode):
+    "Inverse of packBuffers, applying decode to each item"
+    return [decode(buffer[offsets[i]:offsets[i + 1]]) if not isNull[i] else None for i in range(len(isNull))]
+
+def dumpWkb (geoms):
+    "WKB for each geometry (None for missing geometries), vectorized if the installed Shapely supports it"
+    if hasattr(shapely, 'to_wkb'):
+        return list(shapely.to_wkb(np.asarray(geoms, dtype=object)))
+    else:
+        return [shapely.wkb.dumps(g) if g is not None else None for g in geoms]
+
+def loadWkb (buffers):
+    "Inverse of dumpWkb"
+    if hasattr(shapely, 'from_wkb'):
+        return list(shapely.from_wkb(np.asarray(buffers, dtype=object)))
+    else:
+        return [shapely.wkb.loads(b) if b is not None else None for b in buffers]
+
+def packFrame (data, directory=None):
+    """
+    Pack a GeoDataFrame (or DataFrame) into directory, a new temporary directory in shared memory by default.
+    Returns a SharedFrame handle, which can be sent to other processes.
+    """
+    if directory is None:
+        directory = mkdtemp(prefix='zoning-frame-', dir=SHARED_MEMORY_DIR)
+    else:
+        os.makedirs(directory, exist_ok=True)
+
+    meta = {'length': len(data), 'columns': [], 'geometry': None, 'crs': None, 'order': list(data.columns)}
+
+    def save (name, array):
+        np.save(join(directory, name + '.npy'), array)
+
+    def saveBuffers (name, values):
+        buffer, offsets, isNull = packBuffers(values)
+        with open(join(directory, name + '.bin'), 'wb') as out:
+            out.write(buffer)
+        save(name + '.offsets', offsets)
+        save(name + '.null', isNull)
+
+    if isinstance(data, gp.GeoDataFrame):
+        meta['geometry'] = data.geometry.name
+        meta['crs'] = data.crs
+        saveBuffers('geometry', dumpWkb(data.geometry.values))
+
+    columns = [col for col in data.columns if col != meta['geometry']]
+    # only the default index, 0..n-1 without a name, is left out; any other index is stored
+    if not (isinstance(data.index, pd.RangeIndex) and data.index.equals(pd.RangeIndex(len(data))) and data.index.name is None):
+        # keep the index as extra columns, renamed so they cannot collide with existing columns
+        meta['indexNames'] = list(data.index.names)
+        meta['index'] = [f'__index{i}' for i in range(data.index.nlevels)]
+        data = data.copy(deep=False)
+        data.index = data.index.set_names(meta['index'])
+        data = data.reset_index()
+        columns = meta['index'] + columns
+
+    for i, col in enumerate(columns):
+        name = f'column{i}'
+        values = data[col]
+        if hasattr(values, 'cat'):
+            kind = 'category'
+            save(name, values.cat.codes.values)
+            extra = {'categories': values.cat.categories.values.tolist()}
+        elif values.dtype.kind in 'biuf':
+            kind = 'numeric'
+            save(name, values.values)
+            extra = {}
+        elif values.dtype.kind == 'O' and all(v is None or type(v) == str or (type(v) == float and np.isnan(v)) for v in values.values):
+            kind = 'str'
+            saveBuffers(name, [v.encode('utf-8') if type(v) == str else None for v in values.values])
+            extra = {}
+        else:
+            # mixed or unusual types, fall back to pickle
+            kind = 'pickle'
+            with open(join(directory, name + '.pickle'), 'wb') as out:
+                pickle.dump(values.values, out, protocol=pickle.HIGHEST_PROTOCOL)
+            extra = {}
+
+        meta['columns'].append(dict(name=col, file=name, kind=kind, **extra))
+
+    # pickled rather than JSON, since the CRS and column names may be arbitrary objects
+    with open(join(directory, 'meta.pickle'), 'wb') as out:
+        pickle.dump(meta, out)
+
+    return SharedFrame(directory)
+
+class SharedFrame (object):
+    """
+    A handle to a frame packed by packFrame. Only the directory name is pickled, so handles are cheap to send between
+    processes. Columns and geometries are loaded lazily, from memory-mapped files, when they are first used.
+    """
+    def __init__ (self, directory):
+        self.directory = directory
+        with open(join(directory, 'meta.pickle'), 'rb') as raw:
+            self.meta = pickle.load(raw)
+        self._columns = {}
+        self._geometry = None
+
+    def __getstate__ (self):
+        return {'directory': self.directory}
+
+    def __setstate__ (self, state):
+        self.__init__(state['directory'])
+
+    def __len__ (self):
+        return self.meta['length']
+
+    @property
+    def columns (self):
+        return [col['name'] for col in self.meta['columns']]
+
+    def load (self, name):
+        return np.load(join(self.directory, name + '.npy'), mmap_mode='r')
+
+    def loadBuffers (self, name, decode):
+        with open(join(self.directory, name + '.bin'), 'rb') as raw:
+            buffer = raw.read()
+        return unpackBuffers(buffer, self.load(name + '.offsets'), self.load(name + '.null'), decode)
+
+    def column (self, name):
+        "Get a column as a numpy array (memory-mapped for numeric columns, which should be copied before modifying)"
+        if name not in self._columns:
+            col = [c for c in self.meta['columns'] if c['name'] == name][0]
+            if col['kind'] == 'numeric':
+                values = self.load(col['file'])
+            elif col['kind'] == 'category':
+                values = pd.Categorical.from_codes(np.array(self.load(col['file'])), categories=col['categories'])
+            elif col['kind'] == 'str':
+                values = np.array(self.loadBuffers(col['file'], lambda b: b.decode('utf-8')), dtype=object)
+            else:
+                with open(join(self.directory, col['file'] + '.pickle'), 'rb') as raw:
+                    values = pickle.load(raw)
+            self._columns[name] = values
+        return self._columns[name]
+
+    def geometry (self):
+        "Decode the geometries into a GeoSeries"
+        if self.meta['geometry'] is None:
+            raise ValueError('Frame has no geometry')
+        if self._geometry is None:
+            self._geometry = gp.GeoSeries(loadWkb(self.loadBuffers('geometry', bytes)), crs=self.meta['crs'])
+        return self._geometry
+
+    def toFrame (self, columns=None):
+        "Rebuild a (Geo)DataFrame with the given columns (default all)"
+        if columns is None:
+            columns = self.columns
+
+        index = self.meta.get('index', [])
+        out = pd.DataFrame({col: self.column(col) for col in columns + [c for c in index if c not in columns]},
+            columns=columns + [c for c in index if c not in columns])
+        if len(index) > 0:
+            out = out.set_index(index)
+            out.index.names = self.meta['indexNames']
+
+        if self.meta['geometry'] is not None:
+            geometry = self.geometry().copy()
+            geometry.index = out.index
+            out[self.meta['geometry']] = geometry
+            out = gp.GeoDataFrame(out, geometry=self.meta['geometry'], crs=self.meta['crs'])
+
+        # restore the original column order
+        out = out[[col for col in self.meta['order'] if col in out.columns]]
+
+        return out
+
+    def release (self):
+        "Delete the packed data; the handle (and any copies of it in other processes) can no longer be used"
+        if exists(self.directory):
+            rmtree(self.directory)
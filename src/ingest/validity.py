@@ -0,0 +1,81 @@
+# Check geometries for validity in bulk, and repair the invalid ones (e.g. self-intersecting polygons from city
+# shapefiles) before they reach hooks and overlays, where GEOS either slows down badly or raises a TopologyException.
+# Valid geometries are left untouched. Repaired geometries are cached (see cache.py), keyed on the zip file.
+
+# Copyright 2018 Zoning.Space contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import geopandas as gp
+import shapely
+from shapely.geometry import MultiPolygon
+
+from .shputils import readZippedShapefile, polygonParts, snapFrame
+from .cache import cached
+
+# Column added by validShapefile to mark repaired features, so the counts survive the cache; removed by the ingester
+REPAIRED_COLUMN = '_repaired'
+
+def invalidMask (geoms):
+    "Boolean array of which geometries are invalid (missing geometries are not), vectorized if the installed Shapely supports it"
+    geoms = np.asarray(geoms, dtype=object)
+    if hasattr(shapely, 'is_valid'):
+        return ~shapely.is_valid(geoms) & ~shapely.is_missing(geoms)
+    else:
+        return np.array([g is not None and not g.is_valid for g in geoms], dtype=bool)
+
+def repairGeometry (geom):
+    "Repair an invalid polygon, keeping only the polygonal parts of the result; returns None if nothing is left"
+    if hasattr(shapely, 'make_valid'):
+        repaired = shapely.make_valid(geom)
+    else:
+        repaired = geom.buffer(0)
+    parts = [part for part in polygonParts(repaired) if not part.is_empty]
+    if len(parts) == 0:
+        return None
+    return parts[0] if len(parts) == 1 else MultiPolygon(parts)
+
+def repairFrame (df):
+    "Repair the invalid geometries in a GeoDataFrame. Returns the repaired frame and a boolean array of which rows were repaired"
+    invalid = invalidMask(df.geometry.values)
+    if np.any(invalid):
+        df = df.copy()
+        geoms = np.asarray(df.geometry.values, dtype=object).copy()
+        geoms[invalid] = [repairGeometry(g) for g in geoms[invalid]]
+        df[df.geometry.name] = gp.GeoSeries(list(geoms), index=df.index, crs=df.crs)
+    return df, invalid
+
+@cached(files=['shpzip'])
+def repairedGeometries (shpzip, bbox=None):
+    "Positions and repaired geometries of the invalid features of a zipped shapefile (see readZippedShapefile)"
+    shp, repaired = repairFrame(readZippedShapefile(shpzip, bbox=bbox))
+    return gp.GeoDataFrame({'position': np.flatnonzero(repaired)}, geometry=list(shp.geometry.values[repaired]), crs=shp.crs)
+
+def validShapefile (shpzip, bbox=None):
+    """
+    Read a zipped shapefile (see readZippedShapefile) and repair its invalid geometries, marking them in REPAIRED_COLUMN,
+    then snap it to the precision grid if one is set (see shputils.gridSize), which requires valid geometries.
+    Most shapefiles have nothing to repair, and are faster to read again than to cache; only the repaired geometries
+    are cached.
+    """
+    shp = readZippedShapefile(shpzip, bbox=bbox)
+    invalid = invalidMask(shp.geometry.values)
+    if np.any(invalid):
+        repairs = repairedGeometries(shpzip, bbox=bbox)
+        geoms = np.asarray(shp.geometry.values, dtype=object).copy()
+        geoms[repairs.position.values] = list(repairs.geometry.values)
+        shp[shp.geometry.name] = gp.GeoSeries(list(geoms), index=shp.index, crs=shp.crs)
+    shp = snapFrame(shp)
+    shp[REPAIRED_COLUMN] = invalid
+    return shp
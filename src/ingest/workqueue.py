@@ -0,0 +1,148 @@
+# A work queue in a SQLite database, for builds sharded across many worker processes or hosts that share a directory.
+# Workers claim items with a lease, which they renew while they work; if a worker dies, its lease expires and the item is
+# claimed by another worker. Items that fail are retried up to MAX_ATTEMPTS times.
+#
+# SQLite's locking is reliable on local disks and most shared filesystems, but not on some NFS setups; there, the
+# queue should live on a local disk of one host, with the intermediate outputs on the shared filesystem.
+
+# Copyright 2018 Zoning.Space contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import time
+import sqlite3
+from collections import namedtuple
+
+# Seconds a claim lasts unless it is renewed
+LEASE_SECONDS = 300
+
+# Times an item is attempted before it is marked as failed
+MAX_ATTEMPTS = 3
+
+# How long to wait for another process to release the database lock
+BUSY_TIMEOUT_SECONDS = 60
+
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+# A unit of work: a slug, or one chunk of a slug (chunk is then its position in the slug's grid of chunks, and window the
+# longitude/latitude box whose features it processes)
+WorkItem = namedtuple('WorkItem', ['id', 'slug', 'chunk', 'window', 'state', 'worker', 'attempts', 'output', 'error'])
+
+class WorkQueue (object):
+    def __init__ (self, filename):
+        self.filename = filename
+        # autocommit mode, so transactions are only those started explicitly below
+        self.db = sqlite3.connect(filename, timeout=BUSY_TIMEOUT_SECONDS, isolation_level=None)
+        self.db.execute('''CREATE TABLE IF NOT EXISTS items (
+            id INTEGER PRIMARY KEY,
+            slug TEXT NOT NULL,
+            chunk INTEGER NOT NULL,
+            bbox TEXT,
+            state TEXT NOT NULL,
+            worker TEXT,
+            leaseExpires REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            output TEXT,
+            error TEXT,
+            UNIQUE (slug, chunk)
+        )''')
+
+    def close (self):
+        self.db.close()
+
+    def __enter__ (self):
+        return self
+
+    def __exit__ (self, exception_type, exception_value, traceback):
+        self.close()
+
+    def transaction (self):
+        "Start a transaction that takes the write lock immediately, so that claims by concurrent workers are serialized"
+        self.db.execute('BEGIN IMMEDIATE')
+
+    def publish (self, items):
+        "Add work items, given as (slug, chunk, window) tuples with window None for a whole slug. Existing items are left alone."
+        self.transaction()
+        try:
+            self.db.executemany('INSERT OR IGNORE INTO items (slug, chunk, bbox, state) VALUES (?, ?, ?, ?)',
+                [(slug, chunk, json.dumps(window) if window is not None else None, PENDING) for slug, chunk, window in items])
+            self.db.execute('COMMIT')
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+
+    def claim (self, worker, leaseSeconds=LEASE_SECONDS, maxAttempts=MAX_ATTEMPTS):
+        "Claim the next pending item (or one whose lease has expired) for worker, returning it, or None if there are none"
+        now = time.time()
+        self.transaction()
+        try:
+            # items whose workers keep dying (e.g. running out of memory) would otherwise be retried forever
+            self.db.execute('UPDATE items SET state = ?, error = ? WHERE state = ? AND leaseExpires < ? AND attempts >= ?',
+                (FAILED, 'lease expired', LEASED, now, maxAttempts))
+            row = self.db.execute('''SELECT id FROM items
+                WHERE state = ? OR (state = ? AND leaseExpires < ?)
+                ORDER BY slug, chunk LIMIT 1''', (PENDING, LEASED, now)).fetchone()
+            if row is None:
+                self.db.execute('COMMIT')
+                return None
+            self.db.execute('UPDATE items SET state = ?, worker = ?, leaseExpires = ?, attempts = attempts + 1 WHERE id = ?',
+                (LEASED, worker, now + leaseSeconds, row[0]))
+            self.db.execute('COMMIT')
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+        return self.item(row[0])
+
+    def renew (self, itemId, worker, leaseSeconds=LEASE_SECONDS):
+        "Extend worker's lease on an item. Returns False if the worker no longer holds the lease."
+        cursor = self.db.execute('UPDATE items SET leaseExpires = ? WHERE id = ? AND state = ? AND worker = ?',
+            (time.time() + leaseSeconds, itemId, LEASED, worker))
+        return cursor.rowcount == 1
+
+    def complete (self, itemId, worker, output):
+        "Mark an item done, recording its output. Returns False (and records nothing) if the worker no longer holds the lease."
+        cursor = self.db.execute('UPDATE items SET state = ?, output = ?, error = NULL, leaseExpires = NULL WHERE id = ? AND state = ? AND worker = ?',
+            (DONE, output, itemId, LEASED, worker))
+        return cursor.rowcount == 1
+
+    def fail (self, itemId, worker, error, maxAttempts=MAX_ATTEMPTS):
+        "Record a failure, returning the item to the queue unless it has been attempted maxAttempts times"
+        self.db.execute('''UPDATE items SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END, error = ?, leaseExpires = NULL
+            WHERE id = ? AND state = ? AND worker = ?''', (maxAttempts, FAILED, PENDING, error, itemId, LEASED, worker))
+
+    def reset (self, states=(FAILED,)):
+        "Return items in the given states to the queue, with their attempts reset, e.g. to retry failed items after a fix"
+        self.db.execute(f'UPDATE items SET state = ?, attempts = 0, error = NULL WHERE state IN ({", ".join("?" * len(states))})',
+            (PENDING,) + tuple(states))
+
+    def toItem (self, row):
+        itemId, slug, chunk, window, state, worker, attempts, output, error = row
+        return WorkItem(itemId, slug, chunk, tuple(json.loads(window)) if window is not None else None, state, worker,
+            attempts, output, error)
+
+    def item (self, itemId):
+        return self.toItem(self.db.execute('SELECT id, slug, chunk, bbox, state, worker, attempts, output, error FROM items WHERE id = ?',
+            (itemId,)).fetchone())
+
+    def items (self):
+        "All items, in the deterministic order in which their outputs are collated"
+        return [self.toItem(row) for row in
+            self.db.execute('SELECT id, slug, chunk, bbox, state, worker, attempts, output, error FROM items ORDER BY slug, chunk')]
+
+    def counts (self):
+        "Number of items in each state"
+        return dict(self.db.execute('SELECT state, COUNT(*) FROM items GROUP BY state').fetchall())
@@ -0,0 +1,155 @@
+"""
+Compute zoned capacity (buildable units, floor area, and land allowing multifamily) per jurisdiction and per zone while
+the data is collated, so analyses don't need to re-read and re-project the full output.
+"""
+
+# Copyright 2018 Zoning.Space contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pandas as pd
+
+from src.ingest.shputils import EQUAL_AREA_CRS
+
+SQMETERS_PER_HECTARE = 10000
+
+# The columns of the summary table, in order
+summaryColumns = [
+    'jurisdiction',
+    'zone',
+    'features',
+    'areaHectares',
+    'residentialAreaHectares',
+    'loUnits',
+    'hiUnits',
+    'densityUnknownAreaHectares', # residential area with no known density limit, not included in loUnits/hiUnits
+    'densityUnlimitedAreaHectares', # residential area with no density limit, not included in loUnits/hiUnits
+    'loFloorAreaSqMeters',
+    'hiFloorAreaSqMeters',
+    'farUnknownAreaHectares',
+    'farUnlimitedAreaHectares',
+    'singleFamilyAreaHectares',
+    'multiFamilyAreaHectares',
+    'multiFamilyConditionalAreaHectares',
+    'multiFamilyShare'
+]
+
+def allows (use):
+    "Boolean array of whether a use (singleFamily or multiFamily column) is allowed by right or conditionally"
+    return use.isin(['yes', 'conditional']).values
+
+def featureCapacity (data):
+    "Compute capacity metrics for each feature in data, using areas in an equal-area projection"
+    areaSqMeters = data.geometry.to_crs(EQUAL_AREA_CRS).area.values
+    areaHectares = areaSqMeters / SQMETERS_PER_HECTARE
+
+    residential = allows(data.singleFamily) | allows(data.multiFamily)
+    residentialArea = np.where(residential, areaHectares, 0)
+
+    out = pd.DataFrame({
+        'jurisdiction': data.jurisdiction.astype(str).values,
+        'zone': data.zone.astype(str).values,
+        'features': 1,
+        'areaHectares': areaHectares,
+        'residentialAreaHectares': residentialArea
+    })
+
+    def limited (values, area):
+        "Multiply values by area where they are finite, returning (product, unknown area, unlimited area)"
+        values = values.astype(np.float64)
+        finite = np.isfinite(values)
+        return (
+            np.where(finite, values * area, 0),
+            np.where(np.isnan(values), area, 0),
+            np.where(np.isinf(values), area, 0)
+        )
+
+    for prefix in ('lo', 'hi'):
+        # no units can be built where residential uses are not allowed
+        units, unknown, unlimited = limited(data[prefix + 'MaxUnitsPerHectare'].values, residentialArea)
+        out[prefix + 'Units'] = units
+        floorArea, farUnknown, farUnlimited = limited(data[prefix + 'MaxFar'].values, areaSqMeters)
+        out[prefix + 'FloorAreaSqMeters'] = floorArea
+
+    # report the unknown and unlimited areas using the hi values, which are the relevant ones for capacity
+    out['densityUnknownAreaHectares'] = unknown
+    out['densityUnlimitedAreaHectares'] = unlimited
+    out['farUnknownAreaHectares'] = farUnknown / SQMETERS_PER_HECTARE
+    out['farUnlimitedAreaHectares'] = farUnlimited / SQMETERS_PER_HECTARE
+
+    out['singleFamilyAreaHectares'] = np.where(allows(data.singleFamily), areaHectares, 0)
+    out['multiFamilyAreaHectares'] = np.where((data.multiFamily == 'yes').values, areaHectares, 0)
+    out['multiFamilyConditionalAreaHectares'] = np.where((data.multiFamily == 'conditional').values, areaHectares, 0)
+
+    return out
+
+def summarize (capacity, by):
+    "Sum feature capacity by the given columns"
+    summary = capacity.groupby(by, sort=True).sum().reset_index()
+    summary['multiFamilyShare'] = summary.multiFamilyAreaHectares / summary.areaHectares
+    return summary
+
+class CapacityAggregator (object):
+    """
+    Wraps a Collater, computing capacity metrics for all data collated through it. When closed, writes a CSV with a
+    summary row for each jurisdiction (with an empty zone) and for each zone within each jurisdiction.
+    """
+    def __init__ (self, collater, outfile):
+        self.collater = collater
+        self.outfilename = outfile
+        self.capacities = []
+
+    @property
+    def schema (self):
+        return self.collater.schema
+
+    def __enter__ (self):
+        self.open()
+        return self
+
+    def __exit__ (self, exception_type, exception_value, traceback):
+        # passed on, so that the wrapped collater can tell it is being closed because of an error (see GeoPackageCollater
+        # and MultiCollater); the summary is only written if collation finished
+        self.collater.__exit__(exception_type, exception_value, traceback)
+        if exception_type is None:
+            self.write()
+
+    def open (self):
+        self.collater.open()
+
+    def close (self, write=True):
+        self.collater.close()
+        if write:
+            self.write()
+
+    def collate (self, data):
+        print('    Computing zoned capacity...')
+        # aggregate by zone right away so we don't hold on to per-feature values
+        self.capacities.append(summarize(featureCapacity(data), ['jurisdiction', 'zone']))
+        self.collater.collate(data)
+
+    def summary (self):
+        if len(self.capacities) == 0:
+            return pd.DataFrame(columns=summaryColumns)
+
+        byZone = summarize(pd.concat(self.capacities, ignore_index=True).drop('multiFamilyShare', axis=1), ['jurisdiction', 'zone'])
+        byJurisdiction = summarize(byZone.drop(['zone', 'multiFamilyShare'], axis=1), ['jurisdiction'])
+        byJurisdiction['zone'] = ''
+        return pd.concat([byJurisdiction, byZone], ignore_index=True)\
+            .sort_values(['jurisdiction', 'zone'])\
+            .loc[:, summaryColumns]
+
+    def write (self):
+        print(f'Writing zoned capacity summary to {self.outfilename}')
+        self.summary().to_csv(self.outfilename, index=False)
@@ -16,26 +16,76 @@
 
 
 import os.path
+import inspect
 
 datadir = os.path.join(os.path.dirname(__file__), '..', '..', '..', 'data', 'zoning')
 
-def runHook (slug, hook, data):
+def loadHooks (slug):
+    "Execute the hook file for slug and return its namespace, or None if there is no hook file"
+    hookFile = os.path.join(os.path.dirname(__file__), slug + '.py')
+    if not os.path.exists(hookFile):
+        return None
+    else:
+        local_env = {}
+        with open(hookFile) as hookRaw:
+            # compile with the file name, so tracebacks and inspect.getsource (used by the cache) can find the source
+            exec(compile(hookRaw.read(), hookFile, 'exec'), local_env, local_env)
+        return local_env
+
+def getHookAttribute (slug, name, default=None):
+    "Get a module-level declaration (e.g. columns) from the hook file for slug"
+    local_env = loadHooks(slug)
+    if local_env is None:
+        return default
+    else:
+        return local_env.get(name, default)
+
+def hasHook (slug, hook):
+    local_env = loadHooks(slug)
+    return local_env is not None and hook in local_env
+
+def loadAuxiliary (slug, window=None):
+    "Start loading the auxiliary layers declared by the hook file for slug in the background, or return None if there are none"
+    declarations = getHookAttribute(slug, 'auxiliary')
+    if declarations is None:
+        return None
+    else:
+        from src.ingest.auxiliary import loadLayers # imported here to avoid a circular import
+        return loadLayers(declarations, datadir, window)
+
+def requiredFiles (slug):
+    "Names of the files in the data directory needed to process slug: its zipped shapefile and those used by its hooks' auxiliary layers"
+    declarations = getHookAttribute(slug, 'auxiliary')
+    if declarations is None:
+        return [slug + '.zip']
+    from src.ingest.auxiliary import auxiliaryFiles # imported here to avoid a circular import
+    return [slug + '.zip'] + auxiliaryFiles(declarations)
+
+def runHook (slug, hook, data, window=None, layers=None):
+    """
+    Run a hook. If window is specified and the hook takes a window argument, the window is passed on to it. If the hook
+    takes a layers argument, it is passed the auxiliary layers declared by the hook file, which are loaded now if they
+    have not been started already by loadAuxiliary().
+    """
     action = {
         'before': 'preprocessing',
         'after': 'postprocessing'
     }[hook]
 
-    hookFile = os.path.join(os.path.dirname(__file__), slug + '.py')
-    if not os.path.exists(hookFile):
+    local_env = loadHooks(slug)
+    if local_env is None:
         print(f'No hook file found for slug {slug} - not {action} data')
         return data
     else:
-        local_env = {}
-        with open(hookFile) as hookRaw:
-            exec(hookRaw.read(), local_env, local_env)
         if not hook in local_env:
             print(f'No {hook} hook found for slug {slug} - not {action} data')
             return data
         else:
             print(f'Executing {hook} hook for slug {slug}')
-            return local_env[hook](data, datadir)
+            parameters = inspect.signature(local_env[hook]).parameters
+            kwargs = {}
+            if window is not None and 'window' in parameters:
+                kwargs['window'] = window
+            if 'layers' in parameters:
+                kwargs['layers'] = layers if layers is not None else loadAuxiliary(slug, window)
+            return local_env[hook](data, datadir, **kwargs)
@@ -1,24 +1,62 @@
 # Hooks to postprocess Sacramento data
 
-from os.path import join
-import partridge as ptg
 from shapely.geometry import Point
 import geopandas as gp
 import pandas as pd
 import numpy as np
 
 from src.zoning.zoneingest import FOOT_TO_METER, ACRE_TO_HECTARE
-from src.ingest.shputils import readZippedShapefile, fastOverlay
+from src.ingest.shputils import fastOverlay, overlay
+from src.ingest.cache import cached
+from src.ingest.auxiliary import shapefile, derived
 
-def after (data, datadir):
+# the hooks below only use standardized columns
+columns = []
+
+# Areas within a quarter mile of light rail stops, found from GTFS. This is cached between runs, since it only depends
+# on the GTFS feed.
+@cached(files=['gtfs'])
+def lightRailStopAreas (gtfs):
+    # imported here rather than at the top, since the hook file is also loaded just to check which hooks it defines
+    import partridge as ptg
+    feed = ptg.feed(gtfs)
+
+    lightRailRoutes = feed.routes.route_id[feed.routes.route_type == 0]
+    lightRailTrips = feed.trips.trip_id[feed.trips.route_id.isin(lightRailRoutes)]
+    feed.stop_times.set_index(['trip_id', 'stop_sequence'], inplace=True)
+    lightRailStopIds = feed.stop_times.loc[lightRailTrips, 'stop_id'].unique()
+    feed.stops.set_index('stop_id', inplace=True)
+    lightRailStops = feed.stops.loc[lightRailStopIds].copy()
+
+    # convert to geodataframe
+    lightRailStops['geometry'] = lightRailStops.apply(lambda stop: Point(stop.stop_lon, stop.stop_lat), 1)
+    # GTFS is defined to be WGS 84
+    lightRailStops = gp.GeoDataFrame(lightRailStops, geometry='geometry', crs={'init': 'epsg:4326'})
+    lightRailStops = lightRailStops.to_crs(epsg=26942)
+
+    # save memory
+    del feed
+
+    print('buffering light rail stops')
+    lightRailStops['geometry'] = lightRailStops.buffer(5280 / 4 * FOOT_TO_METER, resolution=32)
+
+    return lightRailStops
+
+auxiliary = {
+    # Parking Districts required a CA Public Records Act request:
+    # https://sacramentoca.mycusthelp.com/WEBAPP/_rs/(S(2rztm4xsj04qo445twgqihlj))/RequestArchiveDetails.aspx?rid=8033&view=1
+    'parkingDistricts': shapefile('sacramento_parking.zip', epsg=26942),
+    # this file was created by hand based on the description in the code
+    'centralCity': shapefile('sacramento_central_city.zip', epsg=26942),
+    'lightRailStops': derived(['sacramento_gtfs_20180213.zip'], lambda gtfs, window: lightRailStopAreas(gtfs))
+}
+
+def after (data, datadir, layers=None):
     print('reprojecting data')
     data = data.to_crs(epsg=26942)
 
     print('adding parking requirements \U0001f697')
-    # Parking Districts required a CA Public Records Act request:
-    # https://sacramentoca.mycusthelp.com/WEBAPP/_rs/(S(2rztm4xsj04qo445twgqihlj))/RequestArchiveDetails.aspx?rid=8033&view=1
-    parkingDistricts = readZippedShapefile(join(datadir, 'sacramento_parking.zip')).to_crs(epsg=26942)\
-        .rename(columns={'SECTION': 'parkingDist'})
+    parkingDistricts = layers['parkingDistricts'].rename(columns={'SECTION': 'parkingDist'})
 
     data = fastOverlay(data, parkingDistricts)
     data['parkingDist'] = data.parkingDist.astype('category')
@@ -52,34 +90,10 @@ def after (data, datadir):
 
     # M-1, M-1(S) and M-2 zones conditionally permit multifamily housing iff it is in the central city or within 1/4 mile
     # of a light rail stop
-    print('loading central city')
-     # this file was created by hand based on the description in the code
-    centralCity = readZippedShapefile(join(datadir, 'sacramento_central_city.zip')).to_crs(epsg=26942)
-
-    print('loading light rail stations from GTFS')
-    feed = ptg.feed(join(datadir, 'sacramento_gtfs_20180213.zip'))
-
-    lightRailRoutes = feed.routes.route_id[feed.routes.route_type == 0]
-    lightRailTrips = feed.trips.trip_id[feed.trips.route_id.isin(lightRailRoutes)]
-    feed.stop_times.set_index(['trip_id', 'stop_sequence'], inplace=True)
-    lightRailStopIds = feed.stop_times.loc[lightRailTrips, 'stop_id'].unique()
-    feed.stops.set_index('stop_id', inplace=True)
-    lightRailStops = feed.stops.loc[lightRailStopIds].copy()
-
+    centralCity = layers['centralCity'].copy()
+    lightRailStops = layers['lightRailStops']
     print(f'found {len(lightRailStops)} light rail stops')
 
-    # convert to geodataframe
-    lightRailStops['geometry'] = lightRailStops.apply(lambda stop: Point(stop.stop_lon, stop.stop_lat), 1)
-    # GTFS is defined to be WGS 84
-    lightRailStops = gp.GeoDataFrame(lightRailStops, geometry='geometry', crs={'init': 'epsg:4326'})
-    lightRailStops = lightRailStops.to_crs(epsg=26942)
-
-    # save memory
-    del feed
-
-    print('buffering light rail stops')
-    lightRailStops['geometry'] = lightRailStops.buffer(5280 / 4 * FOOT_TO_METER, resolution=32)
-
     # For M and RMX-SPD-R St zones, we cut these zones out of the whole file, overlay them with the affected area, and
     # then merge them back in.
     print('adding multifamily as conditional use to industrial zones near light rail')
@@ -89,9 +103,9 @@ def after (data, datadir):
     affectedAreas['lightRail'] = True # add a flag column so we know which resulting geometries overlapped
     # and add the central city
     # Do an overlay so that we split large industrial zones at the boundaries of the affected area
-    splitIndustrialAreas = gp.overlay(industrialZones, affectedAreas, how='identity')
+    splitIndustrialAreas = overlay(industrialZones, affectedAreas, how='identity')
     centralCity['centralCity'] = True
-    splitIndustrialAreas = gp.overlay(splitIndustrialAreas, centralCity, how='identity')
+    splitIndustrialAreas = overlay(splitIndustrialAreas, centralCity, how='identity')
 
     splitIndustrialAreas['lightRail'] = splitIndustrialAreas.lightRail.fillna(False)
     splitIndustrialAreas['centralCity'] = splitIndustrialAreas.centralCity.fillna(False)
@@ -107,7 +121,7 @@ def after (data, datadir):
 
     affectedAreas = lightRailStops.loc[:,['geometry']].copy()
     affectedAreas['affected'] = 42 # add a flag column so we know which resulting geometries overlapped
-    splitRmxSpd = gp.overlay(rmxSpdRst, affectedAreas, how='identity')
+    splitRmxSpd = overlay(rmxSpdRst, affectedAreas, how='identity')
     splitRmxSpd['loMaxUnitsPerHectare'] = splitRmxSpd['hiMaxUnitsPerHectare'] =\
         splitRmxSpd.affected.apply(lambda x: 100 / ACRE_TO_HECTARE if x == 42 else 60 / ACRE_TO_HECTARE)
 
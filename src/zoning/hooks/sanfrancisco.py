@@ -3,35 +3,37 @@
 # Receives the data from the shapefile raw, with no conversions or filtering whatsoever. Returns transformed data.
 # It is acceptable to operate in place as long as the data is returned.
 # Data dir is the path to the data/zoning directory, in case auxiliary data needs to be loaded.
+# columns: a list of the columns from the source shapefile that the hooks use, other than those listed in the
+# specfile. When ingesting with compact=True, other source columns are dropped. If it is not defined, all columns are kept.
+# auxiliary: a dict of auxiliary layers the hooks use, loaded in the background and passed to hooks taking a layers argument.
 
 from os.path import join, exists
 import geopandas as gp
 import numpy as np
 from src.zoning.zoneingest import FOOT_TO_METER
-from src.ingest.shputils import readZippedShapefile, fastOverlay
-from tqdm import tqdm
+from src.ingest.shputils import readZippedShapefile, fastOverlay, overlay
 from functools import partial
-
-# Unify several datasets to produce a canonical SF Zoning dataset
-def before (data, datadir):
-    # from https://data.sfgov.org/Housing-and-Buildings/Height-and-Bulk-Districts/tt4g-gzy9/data
-
-    # project to state plane CA Zone 3 (meters)
-    data = data.to_crs(epsg=26943)
-    # read special use districts
-    print('processing special use districts')
-    specialUseDistricts = readZippedShapefile(join(datadir, 'sanfrancisco-special-use-districts.zip')).dissolve('name').to_crs(epsg=26943)
+from src.ingest.cache import cached
+from src.ingest.auxiliary import shapefile, derived
+
+# these hooks only use the zoning columns listed in the specfile
+columns = []
+
+# Some properties are subject to multiple special use districts. Split the map so that each combination of special
+# use districts has its own nonoverlapping polygon. This is cached between runs, since it only depends on the special use
+# districts file.
+@cached(files=['shpzip'])
+def specialUseDistrictTopology (shpzip):
+    specialUseDistricts = readZippedShapefile(shpzip).dissolve('name').to_crs(epsg=26943)
     specialUseDistricts['name'] = specialUseDistricts.index.values
     # Get rid of the really tiny ones (less than 0.25 square km), and ones that don't apply to residences
     relevantSpecialUseDistricts = specialUseDistricts.loc[['Parkmerced', 'Bernal1', 'Candlestick Pt Activity Node', 'Hunters Pt Shipyard Phase 2',
         'India Basin Industrial Park', 'Industrial Protection Zone', 'North of Market Residential 1', 'Telegraph Hill-NB Residential',
         'Van Ness', 'Waterfront 2', 'Waterfront 3']]
 
-    # Some properties are subject to multiple special use districts. Split the map so that each combination of special
-    # use districts has its own nonoverlapping polygon
     # use GeoPandas overlay here, because it properly handles overlapping polygons in the same layer, which we have
     # and is performant enough for such a small dataset
-    topologicalSpecialUseDistricts = gp.overlay(relevantSpecialUseDistricts, relevantSpecialUseDistricts, how='union')
+    topologicalSpecialUseDistricts = overlay(relevantSpecialUseDistricts, relevantSpecialUseDistricts, how='union')
 
     # More than two districts may be overlaid, so name and name_2 cols may not be correct, but topology will be correct
     # Add a new column with the names of all the special use districts affecting a particular topology
@@ -40,23 +42,29 @@ def before (data, datadir):
             # Avoid slivers by only looking at intersections greater than 500 sq feet in area
             lambda geom: ','.join(sorted(relevantSpecialUseDistricts.name[relevantSpecialUseDistricts.intersection(geom).area > 500].values.tolist())))
 
-    heightDistricts = readZippedShapefile(join(datadir, 'sanfrancisco-heightbulk.zip')).to_crs(epsg=26943)
+    return topologicalSpecialUseDistricts
+
+auxiliary = {
+    # not limited to the window, since the topology is cached and the districts are few
+    'specialUseDistricts': derived(['sanfrancisco-special-use-districts.zip'], lambda shpzip, window: specialUseDistrictTopology(shpzip)),
+    # from https://data.sfgov.org/Housing-and-Buildings/Height-and-Bulk-Districts/tt4g-gzy9/data
+    'heightDistricts': shapefile('sanfrancisco-heightbulk.zip', epsg=26943)
+}
+
+# Unify several datasets to produce a canonical SF Zoning dataset
+def before (data, datadir, layers=None):
+    # project to state plane CA Zone 3 (meters)
+    data = data.to_crs(epsg=26943)
 
     print('overlaying special use districts')
-    data = fastOverlay(data, topologicalSpecialUseDistricts)
+    data = fastOverlay(data, layers['specialUseDistricts'])
 
     print('overlaying height districts')
-    data = fastOverlay(data, heightDistricts)
+    data = fastOverlay(data, layers['heightDistricts'])
 
     data.crs = { 'init': 'epsg:26943' } # somehow this gets lost, not sure how
     data = data.to_crs(epsg=4236)
 
-    # fast enough now we probably don't need this
-    try:
-        data.to_file(join(datadir, 'sanfrancisco_processed.json'), driver='GeoJSON')
-    except:
-        print('error creating json file')
-
     return data
 
 def after (data, datadir):
@@ -1,15 +1,46 @@
 from src.zoning.zoneingest import ACRE_TO_HECTARE, FOOT_TO_METER
-from src.ingest.shputils import readZippedShapefile, fastOverlay
-from os.path import join
+from src.ingest.shputils import readZippedShapefile, fastOverlay, overlay, bufferWindow
 import numpy as np
 import pandas as pd
 import geopandas as gp
-from tqdm import tqdm
+from src.ingest.cache import cached
+from src.ingest.auxiliary import shapefile, derived
 
-tqdm.pandas()
+# source columns used by the hooks below
+columns = ['ZONINGABBR', 'PDDENSITY']
+
+# Disjoint areas within 2000 feet of rail stops, with the highest height limit of any nearby stop. This is cached between
+# runs, since it only depends on the stops file.
+@cached(files=['stopsFile'])
+def transitAreas (stopsFile, window=None):
+    stops = readZippedShapefile(stopsFile, bbox=window).to_crs(epsg=26943)
+    stops['geometry'] = stops.buffer(2000 * FOOT_TO_METER) # 2000 feet around rail stops
+    if len(stops) == 0:
+        return stops.loc[:,['height', 'geometry']] # no stops near the window
+
+    # make disjoint, so we can use fastOverlay later
+    print('cleaning transit areas')
+    # imported here rather than at the top, since the hook file is also loaded just to check which hooks it defines
+    from tqdm import tqdm
+    tqdm.pandas()
+    stopsDisjoint = overlay(stops.loc[:,['geometry']], stops.loc[:,['geometry']], how='union')
+    # highest height of any nearby stop
+    stopsDisjoint['height'] = stopsDisjoint.geometry.progress_apply(lambda g: np.max(stops.height[~stops.disjoint(g)]))
+    stopsDisjoint = stopsDisjoint.dissolve('height')
+    # restore col after dissolve
+    stopsDisjoint['height'] = pd.Series(stopsDisjoint.index.values, index=stopsDisjoint.index.values)
+
+    return stopsDisjoint
+
+auxiliary = {
+    'specificHeightDistricts': shapefile('sanjose_specific_height_restrictions.zip', epsg=26943),
+    'airportInfluenceAreas': shapefile('sanjose_airport_influence_areas.zip', epsg=26943),
+    # stops outside the window still affect the area within 2000 feet of them
+    'transitAreas': derived(['sanjose_rail_stops.zip'], lambda stopsFile, window: transitAreas(stopsFile, bufferWindow(window, 2000 * FOOT_TO_METER)))
+}
 
 # copy over the specified Planned Development density
-def after (data, datadir):
+def after (data, datadir, layers=None):
     data = data.to_crs(epsg=26943)
 
     pds = data[data.ZONINGABBR.apply(lambda a: '(PD)' in a)].index
@@ -24,8 +55,8 @@ def after (data, datadir):
     data['hiSpecificHeightMeters'] = np.nan
 
     print('handling specific height restrictions')
-    specificHeightDistricts = readZippedShapefile(join(datadir, 'sanjose_specific_height_restrictions.zip')).to_crs(epsg=26943)
-    airportInfluenceAreas = readZippedShapefile(join(datadir, 'sanjose_airport_influence_areas.zip')).to_crs(epsg=26943)
+    specificHeightDistricts = layers['specificHeightDistricts']
+    airportInfluenceAreas = layers['airportInfluenceAreas'].copy()
     airportInfluenceAreas['airportInfluenceArea'] = True
 
     # overlay
@@ -72,17 +103,7 @@ def after (data, datadir):
     applySpecificHeightDistrict('C.4', 120)
 
     print('applying transit area height limits')
-    stops = readZippedShapefile(join(datadir, 'sanjose_rail_stops.zip')).to_crs(epsg=26943)
-    stops['geometry'] = stops.buffer(2000 * FOOT_TO_METER) # 2000 feet around rail stops
-
-    # make disjoint, so we can use fastOverlay later
-    print('cleaning transit areas')
-    stopsDisjoint = gp.overlay(stops.loc[:,['geometry']], stops.loc[:,['geometry']], how='union')
-    # highest height of any nearby stop
-    stopsDisjoint['height'] = stopsDisjoint.geometry.progress_apply(lambda g: np.max(stops.height[~stops.disjoint(g)]))
-    stopsDisjoint = stopsDisjoint.dissolve('height')
-    # restore col after dissolve
-    stopsDisjoint['height'] = pd.Series(stopsDisjoint.index.values, index=stopsDisjoint.index.values)
+    stopsDisjoint = layers['transitAreas']
 
     # Don't use fastOverlay, the stop areas may overlap
     data = fastOverlay(data, stopsDisjoint)
@@ -0,0 +1,147 @@
+# Assign zoning to parcels. Each parcel gets the attributes of the zone that covers most of its area, and parcels that
+# are split between zones are reported with the share of their area in each zone. Parcels are processed in spatially
+# contiguous chunks across a pool of worker processes; the zoning is handed to the workers once, in shared memory.
+
+# Copyright 2018 Zoning.Space contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import geopandas as gp
+import shapely
+
+from src.ingest.shputils import EQUAL_AREA_CRS
+from src.ingest.spatialsort import hilbertSort
+from src.ingest.transport import packFrame
+
+# Parcels per chunk sent to a worker
+CHUNK_SIZE = 10000
+
+# Zones covering less than this share of a parcel are ignored when reporting split parcels, since they are usually
+# slivers from parcel and zoning boundaries that don't quite line up
+MIN_SPLIT_SHARE = 0.01
+
+# zoning geometries and spatial index in each worker, keyed on the directory of the shared frame
+_zoning = {}
+
+def zoningIndex (handle):
+    "Decode the zoning geometries from a shared frame, and build a spatial index, once per worker process"
+    if handle.directory not in _zoning:
+        geometry = handle.geometry()
+        _zoning.clear()
+        _zoning[handle.directory] = (geometry, geometry.sindex)
+    return _zoning[handle.directory]
+
+def intersectionAreas (parcels, zones, sindex):
+    """
+    Find the zones that intersect each parcel. Returns arrays of parcel positions, zone positions and areas of
+    intersection, with a row for each pair that intersects.
+    """
+    if hasattr(sindex, 'query') and hasattr(shapely, 'intersection'):
+        # bulk query and vectorized intersection, if the installed GeoPandas and Shapely support it
+        parcelIdx, zoneIdx = sindex.query(parcels.values, predicate='intersects')
+        parcelGeoms = np.asarray(parcels.values, dtype=object)[parcelIdx]
+        zoneGeoms = np.asarray(zones.values, dtype=object)[zoneIdx]
+        # most parcels are entirely inside one zone, and don't need the expensive intersection
+        shapely.prepare(zoneGeoms)
+        inside = shapely.contains_properly(zoneGeoms, parcelGeoms)
+        areas = shapely.area(parcelGeoms)
+        areas[~inside] = shapely.area(shapely.intersection(parcelGeoms[~inside], zoneGeoms[~inside]))
+    else:
+        parcelIdx, zoneIdx, areas = [], [], []
+        for i, geom in enumerate(parcels.values):
+            if geom is None:
+                continue
+            for j in sindex.intersection(geom.bounds):
+                if geom.intersects(zones.values[j]):
+                    parcelIdx.append(i)
+                    zoneIdx.append(j)
+                    areas.append(geom.intersection(zones.values[j]).area)
+    return np.asarray(parcelIdx, dtype=np.int64), np.asarray(zoneIdx, dtype=np.int64), np.asarray(areas, dtype=np.float64)
+
+def assignChunk (handle, start, geometries):
+    "Worker task: intersection areas between a chunk of parcels (starting at position start) and the shared zoning"
+    zones, sindex = zoningIndex(handle)
+    parcelIdx, zoneIdx, areas = intersectionAreas(gp.GeoSeries(geometries), zones, sindex)
+    keep = areas > 0
+    return parcelIdx[keep] + start, zoneIdx[keep], areas[keep]
+
+def assignParcels (parcels, zoning, idColumn, columns, workers=None, chunkSize=CHUNK_SIZE):
+    """
+    Assign each parcel in the GeoDataFrame parcels the zone (a row of the GeoDataFrame zoning) that covers most of its
+    area. Returns (assignments, splits): assignments has a row for each parcel with idColumn, the given zoning
+    columns, zoneShare (the share of the parcel in that zone) and zones (the number of zones covering at least
+    MIN_SPLIT_SHARE of it); splits has a row for each zone of each split parcel, with idColumn, the zoning columns and
+    share.
+    """
+    print(f'  Projecting {len(parcels)} parcels and {len(zoning)} zoning features...')
+    parcels = parcels[[idColumn, parcels.geometry.name]].to_crs(EQUAL_AREA_CRS).reset_index(drop=True)
+    # sort parcels along a Hilbert curve, so each chunk only touches a small part of the zoning. Parcels with missing or
+    # empty geometries have no centroid to sort on and can't be in any zone, so they go last and are left unassigned.
+    missing = np.array([g is None or g.is_empty for g in parcels.geometry.values], dtype=bool)
+    located = len(parcels) - int(np.sum(missing))
+    order = np.concatenate([hilbertSort(parcels[~missing]).index.values, np.flatnonzero(missing)]).astype(np.int64)
+    parcels = parcels.iloc[order].reset_index(drop=True)
+    if located < len(parcels):
+        print(f'  {len(parcels) - located} parcels have no geometry')
+    zoning = zoning.to_crs(EQUAL_AREA_CRS).reset_index(drop=True)
+    parcelAreas = parcels.area.values
+
+    handle = packFrame(zoning[[zoning.geometry.name]])
+    try:
+        print(f'  Intersecting parcels with zoning in chunks of {chunkSize}...')
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(assignChunk, handle, start, parcels.geometry.values[start:min(start + chunkSize, located)])
+                for start in range(0, located, chunkSize)
+            ]
+            results = [future.result() for future in futures]
+    finally:
+        handle.release()
+
+    pairs = pd.DataFrame({
+        'parcel': np.concatenate([r[0] for r in results] + [np.zeros(0, dtype=np.int64)]),
+        'zone': np.concatenate([r[1] for r in results] + [np.zeros(0, dtype=np.int64)]),
+        'area': np.concatenate([r[2] for r in results] + [np.zeros(0)])
+    })
+    pairs['share'] = pairs.area.values / parcelAreas[pairs.parcel.values]
+
+    # dominant zone of each parcel: sort by share, and take the last pair for each parcel
+    dominant = pairs.sort_values(['parcel', 'share'], kind='mergesort').drop_duplicates('parcel', keep='last')
+    significant = pairs[pairs.share >= MIN_SPLIT_SHARE]
+    zoneCounts = np.bincount(significant.parcel.values, minlength=len(parcels))
+
+    zoneAttributes = pd.DataFrame(zoning[columns])
+
+    zonePositions = np.full(len(parcels), -1, dtype=np.int64)
+    zonePositions[dominant.parcel.values] = dominant.zone.values
+    shares = np.zeros(len(parcels))
+    shares[dominant.parcel.values] = dominant.share.values
+
+    # reindexing with -1 (no zone) gives missing values
+    assignments = zoneAttributes.reindex(zonePositions).reset_index(drop=True)
+    assignments.insert(0, idColumn, parcels[idColumn].values)
+    assignments['zoneShare'] = np.minimum(shares, 1) # intersections can be a hair larger than the parcel, due to rounding
+    assignments['zones'] = zoneCounts
+
+    split = significant[zoneCounts[significant.parcel.values] > 1]
+    splits = zoneAttributes.iloc[split.zone.values].reset_index(drop=True)
+    splits.insert(0, idColumn, parcels[idColumn].values[split.parcel.values])
+    splits['share'] = np.minimum(split.share.values, 1)
+
+    unassigned = np.sum(zonePositions < 0)
+    print(f'  {np.sum(zoneCounts > 1)} parcels are split between zones, {unassigned} are not covered by any zone')
+
+    return assignments, splits
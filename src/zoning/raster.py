@@ -0,0 +1,302 @@
+# Rasterize zoning attributes onto a grid in an equal-area projection, so that regional analyses (e.g. hectares allowing
+# multifamily near transit) become array math rather than polygon overlays. The grid is split into tiles, which are
+# rasterized in a pool of worker processes with a NumPy scanline fill; each cell gets the attributes of the feature
+# covering its center. The zoning geometries are handed to the workers once, in shared memory.
+#
+# Rasters are written to a directory with a manifest.json describing the grid and the attributes, in one of these formats:
+#  - npy: one uncompressed .npy file per attribute, which can be memory-mapped with np.load(..., mmap_mode='r')
+#  - npz: a compressed .npz file per tile, containing all attributes, with empty tiles omitted
+#  - gtiff: one tiled, DEFLATE-compressed GeoTIFF per attribute (requires the GDAL Python bindings)
+
+# Copyright 2018 Zoning.Space contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import math
+from os.path import join
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+from src.ingest.shputils import EQUAL_AREA_CRS
+from src.ingest.collater import INFINITY
+from src.ingest.transport import packFrame
+
+FORMATS = ['npy', 'npz', 'gtiff']
+
+# Default grid cell size, in meters
+CELL_SIZE = 30
+
+# Tiles are TILE_SIZE x TILE_SIZE cells
+TILE_SIZE = 1024
+
+# Maximum number of (row, edge) pairs considered at once when filling a polygon, to bound memory use
+MAX_CROSSINGS = 1 << 22
+
+# zoning geometries and spatial index in each worker, keyed on the directory of the shared frame
+_zoning = {}
+
+def zoningIndex (handle):
+    "Decode the zoning geometries from a shared frame, and build a spatial index, once per worker process"
+    if handle.directory not in _zoning:
+        geometry = handle.geometry()
+        _zoning.clear()
+        _zoning[handle.directory] = (geometry, geometry.sindex)
+    return _zoning[handle.directory]
+
+def polygonEdges (geom):
+    "Edges of all rings of a polygon or multipolygon, as an array of x0, y0, x1, y1 rows"
+    polygons = geom.geoms if hasattr(geom, 'geoms') else [geom]
+    edges = []
+    for polygon in polygons:
+        if polygon.geom_type != 'Polygon' or polygon.is_empty:
+            continue
+        for ring in [polygon.exterior] + list(polygon.interiors):
+            coords = np.asarray(ring.coords)[:, :2]
+            edges.append(np.hstack([coords[:-1], coords[1:]]))
+    return np.vstack(edges) if len(edges) > 0 else np.zeros((0, 4))
+
+def fillPolygon (out, value, edges):
+    """
+    Set the cells of out whose centers are inside a polygon to value. edges are the polygon's edges (see polygonEdges)
+    in cell coordinates, (column, row) with the origin at the top left corner of out. Uses the even-odd rule, so holes
+    are left unfilled.
+    """
+    nrows, ncols = out.shape
+    edges = edges[edges[:, 1] != edges[:, 3]] # horizontal edges never cross a row center
+    c0, r0, c1, r1 = edges.T
+    top = np.minimum(r0, r1)
+    bottom = np.maximum(r0, r1)
+
+    # rows whose centers fall inside the polygon's extent
+    first = max(int(math.ceil(np.min(top) - 0.5)), 0) if len(edges) > 0 else 0
+    last = min(int(math.ceil(np.max(bottom) - 0.5)), nrows) if len(edges) > 0 else 0
+
+    blockRows = max(MAX_CROSSINGS // max(len(edges), 1), 1)
+    for start in range(first, last, blockRows):
+        centers = np.arange(start, min(start + blockRows, last)) + 0.5
+        # half-open test, so a vertex shared by two edges is only counted once
+        crosses = (top[np.newaxis, :] <= centers[:, np.newaxis]) & (centers[:, np.newaxis] < bottom[np.newaxis, :])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            x = c0 + (centers[:, np.newaxis] - r0) * (c1 - c0) / (r1 - r0)
+        x = np.sort(np.where(crosses, x, np.inf), axis=1)
+
+        # pair up crossings left to right; each pair spans the cells whose centers lie between them
+        x = x[:, :int(np.max(np.sum(crosses, axis=1))) // 2 * 2]
+        starts = np.clip(np.ceil(x[:, 0::2] - 0.5), 0, ncols)
+        ends = np.clip(np.ceil(x[:, 1::2] - 0.5), 0, ncols)
+        valid = np.isfinite(starts) & np.isfinite(ends) & (ends > starts)
+        rows = np.broadcast_to(np.arange(len(centers))[:, np.newaxis], starts.shape)
+
+        # mark the start and end of each span, and take a running sum across each row to find the cells inside
+        spans = np.zeros((len(centers), ncols + 1), dtype=np.int32)
+        np.add.at(spans, (rows[valid], starts[valid].astype(np.int64)), 1)
+        np.add.at(spans, (rows[valid], ends[valid].astype(np.int64)), -1)
+        inside = np.cumsum(spans[:, :-1], axis=1) > 0
+        out[start:start + len(centers)][inside] = value
+
+def rasterizeTile (handle, grid, tile):
+    """
+    Worker task: rasterize the features overlapping a tile (row, column, rows, columns, in cells) of the grid (minx, maxy,
+    cellSize). Returns the tile's offset and an int32 array of the position of the feature covering each cell (-1 for
+    none), or None if no features overlap the tile.
+    """
+    zones, sindex = zoningIndex(handle)
+    minx, maxy, cellSize = grid
+    row, col, nrows, ncols = tile
+    left = minx + col * cellSize
+    top = maxy - row * cellSize
+    positions = sorted(sindex.intersection((left, top - nrows * cellSize, left + ncols * cellSize, top)))
+    if len(positions) == 0:
+        return row, col, None
+
+    out = np.full((nrows, ncols), -1, dtype=np.int32)
+    # in file order, so later features take precedence where features overlap
+    for position in positions:
+        geom = zones.values[position]
+        if geom is None or geom.is_empty:
+            continue
+        edges = polygonEdges(geom)
+        if len(edges) == 0:
+            continue
+        # to cell coordinates relative to the tile
+        edges = np.column_stack([(edges[:, 0] - left) / cellSize, (top - edges[:, 1]) / cellSize,
+            (edges[:, 2] - left) / cellSize, (top - edges[:, 3]) / cellSize])
+        fillPolygon(out, position, edges)
+
+    return row, col, out if np.any(out >= 0) else None
+
+def encodeAttribute (values):
+    """
+    Encode an attribute for rasterization. Returns (table, description): table maps feature positions to raster values,
+    with an extra last entry for cells not covered by any feature, so the raster is table[positions]. Numbers become
+    float32 with NaN for no data (and the output's INFINITY sentinel restored to infinity); strings become integer codes
+    starting at 1, with 0 for no data, and the categories listed in the description.
+    """
+    values = pd.Series(values).reset_index(drop=True)
+    if values.dtype.kind in 'biuf':
+        numbers = values.values.astype(np.float64)
+        numbers[numbers == INFINITY] = np.inf
+        return np.append(numbers, np.nan).astype(np.float32), {'dtype': 'float32', 'nodata': None}
+    else:
+        categories = sorted(set(str(v) for v in values.values if v is not None and v == v))
+        dtype = np.uint8 if len(categories) < 256 else np.uint16
+        codes = pd.Categorical(values.astype(object).where(values.notnull(), None), categories=categories).codes + 1
+        return np.append(codes, 0).astype(dtype), {'dtype': np.dtype(dtype).name, 'nodata': 0, 'categories': categories}
+
+class RasterWriter (object):
+    "Writes rasterized tiles in one of FORMATS, and the manifest"
+    def __init__ (self, outdir, fmt, manifest):
+        self.outdir = outdir
+        self.format = fmt
+        self.manifest = manifest
+        self.arrays = {}
+        os.makedirs(outdir, exist_ok=True)
+
+        for name, attribute in manifest['attributes'].items():
+            nodata = np.nan if attribute['nodata'] is None else attribute['nodata']
+            if fmt == 'npy':
+                attribute['file'] = f'{name}.npy'
+                self.arrays[name] = np.lib.format.open_memmap(join(outdir, attribute['file']), mode='w+',
+                    dtype=attribute['dtype'], shape=(manifest['height'], manifest['width']))
+                self.arrays[name][:] = nodata
+            elif fmt == 'gtiff':
+                attribute['file'] = f'{name}.tif'
+                self.arrays[name] = self.createGeoTiff(join(outdir, attribute['file']), attribute['dtype'], nodata)
+
+        if fmt == 'npz':
+            os.makedirs(join(outdir, 'tiles'), exist_ok=True)
+            manifest['tiles'] = []
+
+    def createGeoTiff (self, filename, dtype, nodata):
+        try:
+            from osgeo import gdal, osr
+        except ImportError:
+            raise RuntimeError('Writing GeoTIFFs requires the GDAL Python bindings; use the npy or npz format instead')
+        gdalType = {'float32': gdal.GDT_Float32, 'uint8': gdal.GDT_Byte, 'uint16': gdal.GDT_UInt16}[dtype]
+        ds = gdal.GetDriverByName('GTiff').Create(filename, self.manifest['width'], self.manifest['height'], 1, gdalType,
+            options=['TILED=YES', 'BLOCKXSIZE=256', 'BLOCKYSIZE=256', 'COMPRESS=DEFLATE', 'BIGTIFF=IF_SAFER'])
+        minx, miny, maxx, maxy = self.manifest['bounds']
+        cellSize = self.manifest['cellSize']
+        ds.SetGeoTransform((minx, cellSize, 0, maxy, 0, -cellSize))
+        srs = osr.SpatialReference()
+        srs.ImportFromProj4(self.manifest['crs'])
+        ds.SetProjection(srs.ExportToWkt())
+        ds.GetRasterBand(1).SetNoDataValue(float(nodata))
+        ds.GetRasterBand(1).Fill(float(nodata))
+        return ds
+
+    def writeTile (self, row, col, tiles):
+        "Write a tile; tiles maps attribute names to arrays"
+        if self.format == 'npz':
+            filename = join('tiles', f'{row}_{col}.npz')
+            np.savez_compressed(join(self.outdir, filename), **tiles)
+            self.manifest['tiles'].append({'row': row, 'column': col, 'file': filename})
+        else:
+            for name, tile in tiles.items():
+                if self.format == 'npy':
+                    self.arrays[name][row:row + tile.shape[0], col:col + tile.shape[1]] = tile
+                else:
+                    self.arrays[name].GetRasterBand(1).WriteArray(tile, col, row)
+
+    def close (self):
+        for array in self.arrays.values():
+            if self.format == 'npy':
+                array.flush()
+            else:
+                array.FlushCache()
+        self.arrays = {}
+        with open(join(self.outdir, 'manifest.json'), 'w') as out:
+            json.dump(self.manifest, out, indent=2)
+
+def rasterGrid (bounds, cellSize, tileSize):
+    "Grid covering bounds (in EQUAL_AREA_CRS), aligned to multiples of cellSize so grids from different runs line up"
+    minx, miny, maxx, maxy = bounds
+    minx = math.floor(minx / cellSize) * cellSize
+    maxy = math.ceil(maxy / cellSize) * cellSize
+    width = max(int(math.ceil((maxx - minx) / cellSize)), 1)
+    height = max(int(math.ceil((maxy - miny) / cellSize)), 1)
+    tiles = [(row, col, min(tileSize, height - row), min(tileSize, width - col))
+        for row in range(0, height, tileSize) for col in range(0, width, tileSize)]
+    return minx, maxy, width, height, tiles
+
+def rasterizeZoning (zoning, outdir, columns, cellSize=CELL_SIZE, fmt='npy', tileSize=TILE_SIZE, workers=None):
+    """
+    Rasterize the given columns of the GeoDataFrame zoning onto a grid of cellSize meters in EQUAL_AREA_CRS, and write
+    them to outdir in format fmt (one of FORMATS), with a manifest.json. Returns the manifest.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f'Unknown raster format {fmt}, expected one of {", ".join(FORMATS)}')
+
+    print(f'  Projecting {len(zoning)} zoning features...')
+    zoning = zoning.to_crs(EQUAL_AREA_CRS).reset_index(drop=True)
+    zoning = zoning[zoning.geometry.notnull() & ~zoning.geometry.is_empty].reset_index(drop=True)
+    if len(zoning) == 0:
+        raise ValueError('No zoning features to rasterize')
+
+    minx, maxy, width, height, tiles = rasterGrid(zoning.total_bounds, cellSize, tileSize)
+    encoded = {col: encodeAttribute(zoning[col].values) for col in columns}
+    manifest = {
+        'crs': EQUAL_AREA_CRS,
+        'cellSize': cellSize,
+        'bounds': [minx, maxy - height * cellSize, minx + width * cellSize, maxy],
+        'width': width,
+        'height': height,
+        'tileSize': tileSize,
+        'format': fmt,
+        'attributes': {col: description for col, (table, description) in encoded.items()}
+    }
+    writer = RasterWriter(outdir, fmt, manifest)
+
+    handle = packFrame(zoning[[zoning.geometry.name]])
+    try:
+        print(f'  Rasterizing a {width} x {height} grid of {cellSize} m cells in {len(tiles)} tiles...')
+        written = 0
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(rasterizeTile, handle, (minx, maxy, cellSize), tile) for tile in tiles]
+            for future in futures:
+                row, col, positions = future.result()
+                if positions is not None:
+                    writer.writeTile(row, col, {name: table[positions] for name, (table, description) in encoded.items()})
+                    written += 1
+        print(f'  {written} tiles contain zoning')
+    finally:
+        handle.release()
+
+    writer.close()
+    return manifest
+
+def readRaster (directory, attribute):
+    """
+    Read an attribute written by rasterizeZoning as a 2D array, memory-mapped for the npy format. Returns the array and
+    the manifest.
+    """
+    with open(join(directory, 'manifest.json')) as raw:
+        manifest = json.load(raw)
+    description = manifest['attributes'][attribute]
+
+    if manifest['format'] == 'npy':
+        return np.load(join(directory, description['file']), mmap_mode='r'), manifest
+    elif manifest['format'] == 'gtiff':
+        from osgeo import gdal
+        return gdal.Open(join(directory, description['file'])).ReadAsArray(), manifest
+    else:
+        out = np.full((manifest['height'], manifest['width']), np.nan if description['nodata'] is None else description['nodata'],
+            dtype=description['dtype'])
+        for tile in manifest['tiles']:
+            with np.load(join(directory, tile['file'])) as data:
+                values = data[attribute]
+            out[tile['row']:tile['row'] + values.shape[0], tile['column']:tile['column'] + values.shape[1]] = values
+        return out, manifest
@@ -0,0 +1,152 @@
+# Sharded builds: slugs, or spatial chunks of large slugs, are published as items in a work queue (see workqueue.py) in a
+# directory shared by any number of worker processes and hosts. Each worker claims items, processes them and packs the
+# result into the directory (see transport.py), and a final step collates the results in a deterministic order.
+
+# Copyright 2018 Zoning.Space contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import socket
+import traceback
+from os.path import join, dirname, exists
+from shutil import rmtree
+from threading import Thread, Event
+
+from src.ingest.workqueue import WorkQueue, LEASE_SECONDS, DONE
+from src.ingest.transport import packFrame, SharedFrame
+
+QUEUE_FILE = 'queue.sqlite'
+FRAMES_DIR = 'frames'
+
+SPEC_DIR = join(dirname(__file__), 'specs')
+DATA_DIR = join(dirname(__file__), '..', '..', 'data', 'zoning')
+
+# Chunks extend this far (in degrees) beyond the bounds of a slug, so features on its edges fall inside a chunk
+CHUNK_MARGIN = 1e-6
+
+def openQueue (queueDir):
+    os.makedirs(queueDir, exist_ok=True)
+    return WorkQueue(join(queueDir, QUEUE_FILE))
+
+def chunkWindows (bounds, n):
+    "Split bounds (minx, miny, maxx, maxy) into an n x n grid of windows, in row-major order"
+    minx, miny, maxx, maxy = bounds
+    minx, miny, maxx, maxy = minx - CHUNK_MARGIN, miny - CHUNK_MARGIN, maxx + CHUNK_MARGIN, maxy + CHUNK_MARGIN
+    dx = (maxx - minx) / n
+    dy = (maxy - miny) / n
+    # the outer edges are set exactly, so rounding can't leave a gap at the maximum edges
+    xs = [minx + i * dx for i in range(n)] + [maxx]
+    ys = [miny + i * dy for i in range(n)] + [maxy]
+    return [(xs[i], ys[j], xs[i + 1], ys[j + 1]) for j in range(n) for i in range(n)]
+
+def publish (queueDir, slugs, grids={}):
+    """
+    Publish a work item for each slug, or for each chunk of an n x n grid over slugs that have an entry n > 1 in grids.
+    Returns the number of items.
+    """
+    from src.ingest.shputils import zippedShapefileBounds
+
+    items = []
+    for slug in slugs:
+        n = grids.get(slug, 1)
+        if n > 1:
+            bounds = zippedShapefileBounds(join(DATA_DIR, slug + '.zip'))
+            items += [(slug, chunk, window) for chunk, window in enumerate(chunkWindows(bounds, n))]
+        else:
+            items.append((slug, 0, None))
+
+    with openQueue(queueDir) as queue:
+        queue.publish(items)
+    return len(items)
+
+def buildItem (queueDir, item, compact=False, merge=False):
+    "Process a work item, pack the result into queueDir, and return the path of the packed frame relative to queueDir"
+    from src.ingest import Collater
+    from src.zoning.zoneingest import ZoneIngester, schema
+
+    # the collater is only used for its schema; results are packed rather than written
+    with open(join(SPEC_DIR, item.slug + '.csv')) as spec:
+        ingester = ZoneIngester(Collater(schema, None), spec, compact=compact, merge=merge, chunk=item.window)
+    df = ingester.process(item.slug, ingester.read(item.slug))
+
+    # one directory per attempt, so a worker whose lease expired can't overwrite the output of the worker that took over
+    output = join(FRAMES_DIR, f'{item.slug}-{item.chunk}-{item.attempts}')
+    tmp = join(queueDir, f'{output}.tmp{os.getpid()}')
+    packFrame(df, tmp)
+    if exists(join(queueDir, output)):
+        rmtree(join(queueDir, output))
+    os.rename(tmp, join(queueDir, output))
+    return output
+
+def heartbeat (queueDir, item, worker, leaseSeconds, stop):
+    "Renew the lease on an item until stop is set"
+    # SQLite connections can't be shared between threads
+    with openQueue(queueDir) as queue:
+        while not stop.wait(leaseSeconds / 3):
+            if not queue.renew(item.id, worker, leaseSeconds):
+                print(f'  WARNING: lost the lease on {item.slug} chunk {item.chunk}')
+                return
+
+def work (queueDir, compact=False, merge=False, leaseSeconds=LEASE_SECONDS):
+    "Claim and process items until the queue is empty. Returns the number of items processed."
+    worker = f'{socket.gethostname()}-{os.getpid()}'
+    processed = 0
+    with openQueue(queueDir) as queue:
+        while True:
+            item = queue.claim(worker, leaseSeconds)
+            if item is None:
+                return processed
+
+            print(f'{worker}: processing {item.slug} chunk {item.chunk} (attempt {item.attempts})...')
+            stop = Event()
+            renewer = Thread(target=heartbeat, args=(queueDir, item, worker, leaseSeconds, stop), daemon=True)
+            renewer.start()
+            try:
+                output = buildItem(queueDir, item, compact=compact, merge=merge)
+            except Exception:
+                print(f'{worker}: {item.slug} chunk {item.chunk} failed')
+                traceback.print_exc()
+                queue.fail(item.id, worker, traceback.format_exc())
+                continue
+            finally:
+                stop.set()
+                renewer.join()
+
+            if queue.complete(item.id, worker, output):
+                processed += 1
+            else:
+                print(f'{worker}: {item.slug} chunk {item.chunk} was taken over by another worker, discarding output')
+                rmtree(join(queueDir, output))
+
+def runWorker (queueDir, compact=False, merge=False, leaseSeconds=LEASE_SECONDS, precision=None, useCache=True):
+    """
+    Run a worker (see work) with the given precision model and cache setting. Defined at module level, and setting the
+    module state itself, so that it can be the target of a worker process with any multiprocessing start method.
+    """
+    from src.ingest import cache, shputils
+    cache.enabled = useCache
+    shputils.gridSize = precision
+    return work(queueDir, compact=compact, merge=merge, leaseSeconds=leaseSeconds)
+
+def collate (queueDir, collater):
+    "Collate the outputs of all items, in order of slug and chunk. All items must be done."
+    with openQueue(queueDir) as queue:
+        items = queue.items()
+    unfinished = [item for item in items if item.state != DONE]
+    if len(unfinished) > 0:
+        raise ValueError(f'{len(unfinished)} items are not done: ' + ', '.join(f'{i.slug} chunk {i.chunk} ({i.state})' for i in unfinished))
+
+    for item in items:
+        print(f'  Collating {item.slug} chunk {item.chunk}...')
+        collater.collate(SharedFrame(join(queueDir, item.output)).toFrame())
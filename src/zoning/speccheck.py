@@ -0,0 +1,88 @@
+"""
+Check a specfile against the zone designations in a zipped shapefile, without running the full ingestion.
+"""
+
+# Copyright 2018 Zoning.Space contributors
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pandas as pd
+
+from src.ingest.rawshapefile import readZippedShapefileAttributes
+
+def zoneKeys (data, colset):
+    "Keys of the zone table indexed by colset for each row of data, formatted the same way as ZoneIngester.transform"
+    if len(colset) > 1:
+        return pd.Series(list(zip(*[data[col].values for col in colset])), index=data.index)
+    else:
+        return data[colset[0]]
+
+def formatKey (key):
+    return '-'.join(str(k) for k in key) if type(key) == tuple else str(key)
+
+def checkSpec (ingester, shpzip):
+    """
+    Check the zone tables of ingester (a ZoneIngester) against the zone columns of the shapefile in shpzip. Prints a
+    report of zones that are not matched by each table, with their share of land area, and specfile rows that are not
+    used. Returns the share of land area that is not matched by any table that could be checked.
+    """
+    data = readZippedShapefileAttributes(shpzip, ingester.zoneColumns, areas=True)
+    totalArea = np.sum(data.area)
+
+    # Convert Nones to empty strings, as in ZoneIngester.transform
+    missingColumns = [col for col in ingester.zoneColumns if col not in data.columns]
+    for col in ingester.zoneColumns:
+        if col in data.columns:
+            data[col] = data[col].apply(lambda x: x if x is not None and not pd.isnull(x) else '')
+
+    if len(missingColumns) > 0:
+        print(f'Columns {", ".join(missingColumns)} are not in the shapefile, presumably they are created by hooks')
+
+    matchedAny = np.zeros(len(data), dtype=bool)
+    checked = 0
+    for i, zoneTable in enumerate(ingester.zoneTables):
+        colset = list(zoneTable.index.names)
+        print(f'Table {i + 1} ({", ".join(colset)}):')
+
+        if not all(col in data.columns for col in colset):
+            print('  skipped, uses columns that are created by hooks')
+            continue
+
+        checked += 1
+        keys = zoneKeys(data, colset)
+        matched = keys.isin(set(zoneTable.index.values)).values
+        matchedAny |= matched
+
+        unmatchedArea = data.area[~matched].groupby(keys[~matched]).sum().sort_values(ascending=False)
+        if len(unmatchedArea) > 0:
+            print(f'  {len(unmatchedArea)} zones not in specfile ({np.sum(unmatchedArea) / totalArea:.2%} of land area):')
+            for key, area in unmatchedArea.iteritems():
+                print(f'    {formatKey(key)}: {area / totalArea:.2%}')
+        else:
+            print('  all zones matched')
+
+        presentKeys = set(keys.values)
+        unused = sorted(set(formatKey(key) for key in zoneTable.index.values if key not in presentKeys))
+        if len(unused) > 0:
+            print(f'  {len(unused)} specfile rows do not match any zone:')
+            for key in unused:
+                print(f'    {key}')
+
+    if checked == 0:
+        print('No tables could be checked without running hooks')
+        return np.nan
+
+    unmatchedShare = np.sum(data.area[~matchedAny]) / totalArea
+    print(f'{unmatchedShare:.2%} of land area is not matched by any table')
+    return unmatchedShare
@@ -81,6 +81,15 @@ for key, val in variables.items():
 
 schema['properties']['jurisdiction'] = 'str'
 
+# Columns that, together with the geometry, identify an output feature across builds (see src/ingest/featurekeys.py)
+KEY_COLUMNS = ['jurisdiction', 'zone']
+
+# Allowed values of the enumerated variables
+categories = {
+    'singleFamily': ['yes', 'no', 'conditional'],
+    'multiFamily': ['yes', 'no', 'conditional']
+}
+
 def isBlank (line):
     return len(line) == 0 or all([c == '' for c in line])
 
@@ -111,10 +120,15 @@ def processLine(line):
     return [c.strip() if not c.strip().startswith('#') else '' for c in line] # filter single cell comments
 
 class ZoneIngester(Ingester):
-    def __init__ (self, collater, definition):
-        super().__init__(collater)
+    categories = categories
+
+    def __init__ (self, collater, definition, compact=False, window=None, merge=False, chunk=None):
+        super().__init__(collater, compact=compact, window=window, merge=merge, chunk=chunk)
         self.readDefinition(definition)
 
+    def sourceColumns (self):
+        return self.zoneColumns
+
     def readDefinition (self, definition):
         rdr = csv.reader(definition)
 